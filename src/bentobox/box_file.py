@@ -33,42 +33,520 @@
 
 # --- end-of-header ---
 
+import json
+import os
+import sys
+
+
+MARK_END_OF_HEADER = "# --- end-of-header ---"
+MARK_END_OF_SOURCE = "# --- end-of-source ---"
+MARK_ARCHIVES = "# --- archives ---"
+MARK_PAYLOAD = "# --- payload ---"
+
+RUNTIME_CACHE_PREFIX = "bentobox-runtime-"
+RUNTIME_CACHE_SUFFIX = ".pyc"
+
+ZYGOTE_SOCKET = "bentobox-zygote.sock"
+ZYGOTE_SOCKET_MAX_LEN = 100
+ZYGOTE_TIMEOUT = 300
+ZYGOTE_CHECK_INTERVAL = 10
+
+ASSETS_DIR = "assets"
+ASSET_ENV_PREFIX = "BENTOBOX_ASSET_"
+
+
+################################################################################
+### fast path ##################################################################
+################################################################################
+
+def boolean(value):
+    """Make a boolean value from a string"""
+    value = value.lower()
+    if value in {'on', 'true'}:
+        return True
+    if value in {'off', 'false'}:
+        return False
+    return bool(int(value))
+
+
+def _fast_env_flag(var_name, default):
+    """Get a boolean environment variable; returns None if the value is invalid"""
+    value = os.environ.get(var_name, None)
+    if value is None:
+        return default
+    try:
+        return boolean(value)
+    except ValueError:
+        return None
+
+
+def get_link_name():
+    """Return the name of the link the box was run through, or None
+
+    Multi-command boxes dispatch on this name only if it differs from the
+    name of the box file, so that a box named after one of its commands
+    still takes the command as first argument.
+    """
+    link_name = os.path.basename(sys.argv[0])
+    if os.path.basename(os.path.realpath(sys.argv[0])) == link_name:
+        return None
+    return link_name
+
+
+def _read_box_doc(box_path):
+    """Read the box state json from the box header"""
+    mark = MARK_END_OF_HEADER.encode('utf-8')
+    data = b''
+    with open(box_path, 'rb') as box_file:
+        while mark not in data:
+            chunk = box_file.read(65536)
+            if not chunk:
+                break
+            data += chunk
+    begin = data.index(b'\n"""\n') + 5
+    end = data.index(b'\n"""\n', begin)
+    return str(data[begin:end], 'utf-8')
+
+
+def read_box_source(box_path):
+    """Read the box source (header and runtime), without the archives"""
+    mark = ("\n" + MARK_END_OF_SOURCE + "\n").encode('utf-8')
+    data = b''
+    with open(box_path, 'rb') as box_file:
+        while mark not in data:
+            chunk = box_file.read(65536)
+            if not chunk:
+                return data
+            data += chunk
+    return data[:data.index(mark) + len(mark)]
+
+
+def _run_box_source(box_path):
+    """Compile and run the box source, bypassing the cached runtime"""
+    code = compile(read_box_source(box_path), box_path, 'exec')
+    exec(code, {'__name__': '__main__', '__file__': box_path,  # pylint: disable=exec-used
+                '__builtins__': __builtins__})
+    sys.exit(0)
+
+
+def _read_command_index(install_dir, venv_bin_dir):
+    """Read the command index; returns None if it is missing or stale"""
+    try:
+        with open(os.path.join(install_dir, "bentobox-commands.json"), "r") as index_file:
+            index = json.load(index_file)
+        if index['bin_dir_mtime'] != os.stat(venv_bin_dir).st_mtime_ns:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return index
+
+
+def load_entry_point(entry_point):
+    """Load the object referenced by an entry point value 'module:attr'"""
+    module_name, _, attr = entry_point.partition('[')[0].strip().partition(':')
+    __import__(module_name)
+    obj = sys.modules[module_name]
+    if attr:
+        for name in attr.split('.'):
+            obj = getattr(obj, name)
+    return obj
+
+
+def call_entry_point(entry_point):
+    """Call an entry point as a console script does; returns the exit status"""
+    try:
+        result = load_entry_point(entry_point)()
+    except SystemExit as err:
+        result = err.code
+    except BaseException:  # pylint: disable=broad-except
+        import traceback  # pylint: disable=import-outside-toplevel
+        traceback.print_exc()
+        result = 1
+    if result is None:
+        result = 0
+    elif not isinstance(result, int):
+        print(result, file=sys.stderr)
+        result = 1
+    return result
+
+
+def _send_message(sock, message, fds=None):
+    """Send a length-prefixed json message, optionally with file descriptors"""
+    payload = json.dumps(message).encode('utf-8')
+    prefix = len(payload).to_bytes(4, 'big')
+    if fds:
+        import socket  # pylint: disable=import-outside-toplevel
+        socket.send_fds(sock, [prefix], fds)
+    else:
+        sock.sendall(prefix)
+    sock.sendall(payload)
+
+
+def _recv_exactly(sock, size):
+    """Receive exactly size bytes; returns None at EOF"""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _recv_message(sock):
+    """Receive a length-prefixed json message; returns None at EOF"""
+    prefix = _recv_exactly(sock, 4)
+    if prefix is None:
+        return None
+    payload = _recv_exactly(sock, int.from_bytes(prefix, 'big'))
+    if payload is None:
+        return None
+    return json.loads(str(payload, 'utf-8'))
+
+
+def get_zygote_socket_path(install_dir):
+    """Get the zygote server socket path, or None if it is too long for a unix socket"""
+    socket_path = os.path.join(os.path.abspath(install_dir), ZYGOTE_SOCKET)
+    if len(socket_path.encode('utf-8')) > ZYGOTE_SOCKET_MAX_LEN:
+        return None
+    return socket_path
+
+
+def _zygote_call(socket_path, entry_point, argv, environ):
+    """Run a command through the zygote server
+
+    Returns the exit status, or None if the server is not available.
+    """
+    import signal  # pylint: disable=import-outside-toplevel
+    import socket  # pylint: disable=import-outside-toplevel
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(socket_path)
+            _send_message(sock, {
+                'entry_point': entry_point,
+                'argv': argv,
+                'environ': environ,
+                'cwd': os.getcwd(),
+            }, fds=[0, 1, 2])
+            reply = _recv_message(sock)
+        except OSError:
+            return None
+        if reply is None:
+            return None
+        worker_pid = reply['pid']
+
+        def forward_signal(signum, frame):  # pylint: disable=unused-argument
+            try:
+                os.kill(worker_pid, signum)
+            except OSError:
+                pass
+
+        for signum in signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT:
+            signal.signal(signum, forward_signal)
+        reply = _recv_message(sock)
+    if reply is None:
+        print("[BENTOBOX] zygote server connection lost", file=sys.stderr)
+        return 1
+    status = reply['status']
+    if status < 0:
+        status = 128 - status
+    return status
+
+
+def has_zygote_support():
+    """Tell if the python running the box can use the zygote server (python >= 3.9)"""
+    import socket  # pylint: disable=import-outside-toplevel
+    return hasattr(socket, 'send_fds') and hasattr(os, 'waitstatus_to_exitcode')
+
+
+def _zygote_spawn(python, box_path):
+    """Start the zygote server in background"""
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            os.setsid()
+            if os.fork() == 0:
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in 0, 1, 2:
+                    os.dup2(devnull, fd)
+                environ = os.environ.copy()
+                environ['BENTOBOX_WRAPPING'] = 'off'
+                os.execve(python, [python, box_path, "zygote"], environ)
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    os.waitpid(pid, 0)
+
+
+def get_asset_environ(install_dir, state):
+    """Get the environment variables with the paths of the extracted assets"""
+    environ = {}
+    assets = state.get('assets', None)
+    if assets:
+        assets_dir = os.path.join(str(install_dir), ASSETS_DIR)
+        environ['BENTOBOX_ASSETS_DIR'] = assets_dir
+        for asset_data in assets:
+            environ[ASSET_ENV_PREFIX + asset_data['name']] = os.path.join(
+                assets_dir, asset_data['name'])
+    return environ
+
+
+def is_venv_python(install_dir):
+    """Tell if the box is running with the virtualenv python of install_dir"""
+    return os.path.realpath(sys.prefix) == os.path.realpath(os.path.join(install_dir, "virtualenv"))
+
+
+def _call_in_process(entry_point, argv, environ):
+    """Call an entry point in this process, as its console script would do"""
+    os.environ.update(environ)
+    sys.argv[:] = argv
+    sys.path[0] = os.path.dirname(argv[0])
+    return call_entry_point(entry_point)
+
+
+ENV_SHEBANG_PREFIX = "/usr/bin/env -S LD_LIBRARY_PATH="
+ENV_SHEBANG_SUFFIX = ":${LD_LIBRARY_PATH} "
+
+
+def get_frozen_lib_path(python_interpreter):
+    """Get the lib path frozen in an 'env -S' box shebang, or None"""
+    if not python_interpreter.startswith(ENV_SHEBANG_PREFIX):
+        return None
+    return python_interpreter[len(ENV_SHEBANG_PREFIX):].partition(ENV_SHEBANG_SUFFIX)[0]
+
+
+def add_lib_path(environ, lib_path):
+    """Prepend lib_path to the LD_LIBRARY_PATH of environ, if it is missing"""
+    lib_dirs = [lib_dir for lib_dir in environ.get('LD_LIBRARY_PATH', '').split(':') if lib_dir]
+    frozen_dirs = [lib_dir for lib_dir in lib_path.split(':') if lib_dir]
+    if lib_dirs[:len(frozen_dirs)] != frozen_dirs:
+        lib_dirs[:0] = frozen_dirs
+    environ['LD_LIBRARY_PATH'] = ':'.join(lib_dirs)
+
+
+def _run_command(install_dir, executable, entry_point, args, environ,
+                 zygote=False, in_process=False):
+    """Run an installed command
+
+    If the entry point is known, the command is run through the zygote
+    server (if enabled and supported by the box python), or called in this
+    process (if enabled and the box is running with the virtualenv python),
+    provided that the library path of the command is the one of this
+    process; otherwise the console script is executed.
+    """
+    cmdline = [executable] + list(args)
+    # if the command needs another library path (e.g. the box was not run
+    # through its 'env -S' shebang) this process and the zygote cannot run it
+    if environ.get('LD_LIBRARY_PATH', None) != os.environ.get('LD_LIBRARY_PATH', None):
+        entry_point = None
+    if entry_point:
+        if zygote and has_zygote_support():
+            socket_path = get_zygote_socket_path(install_dir)
+            if socket_path is not None:
+                status = _zygote_call(socket_path, entry_point, cmdline, environ)
+                if status is not None:
+                    sys.exit(status)
+                python = os.path.join(install_dir, "virtualenv", "bin", "python")
+                _zygote_spawn(python, os.path.abspath(__file__))
+        if in_process and is_venv_python(install_dir):
+            sys.exit(_call_in_process(entry_point, cmdline, environ))
+    os.execve(executable, cmdline, environ)
+
+
+def _clean_library_path(state, argv):
+    """Re-exec the box interpreter if its LD_LIBRARY_PATH has an empty entry
+
+    The 'env -S' shebang of the 'environ' freeze mode leaves an empty entry
+    when LD_LIBRARY_PATH was unset, and the dynamic loader would search the
+    current directory for the libraries of the box process; the interpreter
+    is run again directly, with the empty entries removed.
+    """
+    lib_path = os.environ.get('LD_LIBRARY_PATH', None)
+    if lib_path is None or get_frozen_lib_path(state['python_interpreter']) is None:
+        return
+    lib_dirs = lib_path.split(':')
+    if all(lib_dirs):
+        return
+    os.environ['LD_LIBRARY_PATH'] = ':'.join(lib_dir for lib_dir in lib_dirs if lib_dir)
+    os.execv(sys.executable, [sys.executable] + argv)
+
+
+def _fast_wrap(state, args):
+    """Exec the wrapped command if the box is already installed
+
+    This is the fast path for wrapping boxes: only os, sys and json are
+    used. If anything is missing or unexpected, the function simply returns
+    and the full box runtime takes over.
+    """
+    wrap_mode = state['wrap_mode']
+    if wrap_mode not in {'SINGLE', 'MULTIPLE', 'ALL'}:
+        return
+    if _fast_env_flag("BENTOBOX_WRAPPING", True) is not True:
+        return
+    if _fast_env_flag("BENTOBOX_FORCE_REINSTALL", False) is not False:
+        return
+
+    install_dir = os.environ.get("BENTOBOX_INSTALL_DIR", None)
+    if install_dir is None:
+        install_dir = state['install_dir']
+    if install_dir is None:
+        install_dir = os.path.join(os.path.expanduser("~"), ".bentobox", "boxes",
+                                   state['box_name'])
+    fingerprint = state.get('fingerprint', None)
+    if fingerprint is None:
+        return
+    try:
+        with open(os.path.join(install_dir, "bentobox-stamp"), "r") as stamp_file:
+            if stamp_file.read() != fingerprint:
+                return
+    except OSError:
+        return
+    venv_bin_dir = os.path.join(install_dir, "virtualenv", "bin")
+    update_shebang = _fast_env_flag("BENTOBOX_UPDATE_SHEBANG", state['update_shebang'])
+    if update_shebang is not False:
+        # with the 'environ' freeze mode the shebang is 'env -S ... PYTHON'
+        if os.path.dirname(state['python_interpreter'].split()[-1]) != venv_bin_dir:
+            return
+        cache_runtime = _fast_env_flag("BENTOBOX_CACHE_RUNTIME", state.get('cache_runtime', False))
+        if cache_runtime is not False and not state.get('runtime_cache', None):
+            return
+
+    index = None
+    if wrap_mode == 'SINGLE':
+        command = state['wraps']
+    else:
+        if wrap_mode == 'MULTIPLE':
+            commands = state['wraps']
+        else:
+            index = _read_command_index(install_dir, venv_bin_dir)
+            if index is None:
+                return
+            commands = {name: name for name, command_info in index['commands'].items()
+                        if command_info['installed']}
+        # multi-call dispatch: the box may be run through a link named after the command
+        command = commands.get(get_link_name(), None)
+        if command is None:
+            if not args:
+                return
+            command = commands.get(args[0], None)
+            if command is None:
+                return
+            args = args[1:]
+
+    entry_point = None
+    zygote = _fast_env_flag("BENTOBOX_ZYGOTE", state.get('zygote', False))
+    if zygote is None:
+        return
+    in_process = _fast_env_flag("BENTOBOX_IN_PROCESS", True)
+    if in_process is None:
+        return
+    if zygote or (in_process and is_venv_python(install_dir)):
+        if index is None:
+            index = _read_command_index(install_dir, venv_bin_dir)
+            if index is None:
+                return
+        command_info = index['commands'].get(command, None)
+        if command_info is None:
+            return
+        entry_point = command_info['entry_point']
+
+    executable = os.path.join(venv_bin_dir, command)
+    if not os.access(executable, os.X_OK):
+        return
+    environ = os.environ.copy()
+    new_path = os.path.realpath(venv_bin_dir)
+    old_path = environ.get("PATH", "")
+    if old_path:
+        new_path += ":" + old_path
+    environ['PATH'] = new_path
+    frozen_lib_path = get_frozen_lib_path(state['python_interpreter'])
+    if frozen_lib_path:
+        add_lib_path(environ, frozen_lib_path)
+    environ.update(get_asset_environ(install_dir, state))
+    _run_command(install_dir, executable, entry_point, args, environ,
+                 zygote=zygote, in_process=in_process)
+
+
+if __name__ == "__main__":
+    _ARGV = list(sys.argv)
+    if __doc__ is None:
+        # this is the cached runtime bytecode written by install; the box
+        # shebang runs it as 'python bentobox-runtime-HASH.pyc BOX ARGS...'
+        _RUNTIME_HASH = os.path.basename(__file__)[
+            len(RUNTIME_CACHE_PREFIX):-len(RUNTIME_CACHE_SUFFIX)]
+        __file__ = sys.argv.pop(1)
+        sys.argv[0] = __file__
+        __doc__ = _read_box_doc(__file__)  # pylint: disable=redefined-builtin
+        _STATE = json.loads(__doc__)
+        if _STATE.get('runtime_hash', None) != _RUNTIME_HASH:
+            _run_box_source(__file__)
+    else:
+        _STATE = json.loads(__doc__)
+    _clean_library_path(_STATE, _ARGV)
+    _fast_wrap(_STATE, sys.argv[1:])
+
+
+# the full runtime: modules below are not needed by the fast path
+# pylint: disable=wrong-import-position,wrong-import-order
 import argparse
+import binascii
 import collections.abc
+import concurrent.futures
 import contextlib
 import enum
+import fcntl
 import functools
-import json
+import hashlib
+import io
+import itertools
 import logging
 import logging.config
-import os
+import mmap
+import multiprocessing
+import re
+import selectors
 import shlex
 import shutil
+import signal
+import socket
+import struct
 import subprocess
-import sys
+import sysconfig
 import tempfile
 import textwrap
+import time
 import traceback
 import venv
+import zipfile
 
-from base64 import b64decode
 from pathlib import Path
 
 __all__ = [
     'MARK_END_OF_HEADER',
     'MARK_END_OF_SOURCE',
     'MARK_ARCHIVES',
+    'MARK_PAYLOAD',
     'HEADER_FILL_LEN',
     'WrapMode',
     'WrapInfo',
     'wrap_single',
     'wrap_multiple',
     'create_header',
+    'load_state',
+    'parse_header_size',
+    'make_bootstrap',
+    'make_fingerprint',
     'replace_state',
     'show',
     'check',
     'install',
     'extract',
+    'verify',
+    'get_assets',
+    'get_asset_path',
+    'open_asset',
+    'get_wheel_tags',
+    'check_wheels',
 ]
 
 # pylint: disable=too-many-lines
@@ -125,10 +603,9 @@ UNDEFINED = object()
 
 HEADER = "[BENTOBOX] "
 
-MARK_END_OF_HEADER = "# --- end-of-header ---"
-MARK_END_OF_SOURCE = "# --- end-of-source ---"
-MARK_ARCHIVES = "# --- archives ---"
 HEADER_FILL_LEN = 20 * (80 + 1)
+HEADER_BLOCK_SIZE = 4096
+HEADER_SIZE_LINE = "# --- header-size {:010d} ---"
 
 _LOG_STATE = None
 
@@ -197,23 +674,21 @@ def get_env(var_name, var_type=str, default=None):
             return default
 
 
-def boolean(value):
-    """Make a boolean value from a string"""
-    value = value.lower()
-    if value in {'on', 'true'}:
-        return True
-    if value in {'off', 'false'}:
-        return False
-    return bool(int(value))
-
-
 INSTALL_DIR = get_env("BENTOBOX_INSTALL_DIR", var_type=Path, default=None)
 WRAPPING = get_env("BENTOBOX_WRAPPING", var_type=boolean, default=True)
 VERBOSE_LEVEL = get_env("BENTOBOX_VERBOSE_LEVEL", var_type=int, default=STATE['verbose_level'])
 DEBUG = get_env("BENTOBOX_DEBUG", var_type=boolean, default=STATE['debug'])
 FREEZE = get_env("BENTOBOX_FREEZE", var_type=boolean, default=STATE['freeze'])
-UPDATE_SHEBANG = get_env("BENTOBOX_FREEZE", var_type=boolean, default=STATE['update_shebang'])
+UPDATE_SHEBANG = get_env("BENTOBOX_UPDATE_SHEBANG", var_type=boolean,
+                         default=STATE['update_shebang'])
 FORCE_REINSTALL = get_env("BENTOBOX_FORCE_REINSTALL", var_type=boolean, default=False)
+CACHE_RUNTIME = get_env("BENTOBOX_CACHE_RUNTIME", var_type=boolean,
+                        default=STATE.get('cache_runtime', False))
+ZYGOTE = get_env("BENTOBOX_ZYGOTE", var_type=boolean, default=STATE.get('zygote', False))
+IN_PROCESS = get_env("BENTOBOX_IN_PROCESS", var_type=boolean, default=True)
+VERIFY = get_env("BENTOBOX_VERIFY", var_type=boolean, default=True)
+ZYGOTE_IDLE_TIMEOUT = get_env("BENTOBOX_ZYGOTE_TIMEOUT", var_type=float,
+                              default=STATE.get('zygote_timeout', ZYGOTE_TIMEOUT))
 
 
 def get_verbose_level(verbose_level=None):
@@ -230,18 +705,18 @@ def get_debug(debug=None):
     return debug
 
 
-def default_install_dir():
+def default_install_dir(state=STATE):
     """Returns the default install dir"""
-    return Path.home() / ".bentobox" / "boxes" / STATE['box_name']
+    return Path.home() / ".bentobox" / "boxes" / state['box_name']
 
 
-def get_install_dir():
+def get_install_dir(state=STATE):
     """Returns the current install dir"""
     if INSTALL_DIR:
         return INSTALL_DIR
-    install_dir = STATE['install_dir']
+    install_dir = state['install_dir']
     if install_dir is None:
-        install_dir = default_install_dir()
+        install_dir = default_install_dir(state)
     return Path(install_dir)
 
 
@@ -256,6 +731,31 @@ def get_config():
     return config
 
 
+def get_stamp(install_dir=None):
+    """Get the fingerprint of the installed box, if any"""
+    if install_dir is None:
+        install_dir = get_install_dir()
+    stamp_path = Path(install_dir) / 'bentobox-stamp'
+    try:
+        with open(stamp_path, 'r') as stamp_file:
+            return stamp_file.read()
+    except OSError:
+        return None
+
+
+def make_fingerprint(state):
+    """Make the content fingerprint of the box packages"""
+    data = {
+        'packages': state['packages'],
+        'pip_install_args': state['pip_install_args'],
+        'python_interpreter': state['python_interpreter'],
+    }
+    if state.get('assets', None):
+        data['assets'] = state['assets']
+    data_json = json.dumps(tojson(data), sort_keys=True)
+    return hashlib.sha1(data_json.encode('utf-8')).hexdigest()
+
+
 def get_wrap_info(state=STATE):
     """Return the WrapInfo"""
     if WRAPPING:
@@ -272,6 +772,9 @@ def get_environ(config):
     if old_path:
         new_path += ":" + old_path
     environ['PATH'] = new_path
+    if config.get('freeze_mode', None) == 'environ':
+        add_lib_path(environ, config['freeze_lib_path'])
+    environ.update(get_asset_environ(config['install_dir'], STATE))
     return environ
 
 
@@ -289,6 +792,76 @@ def find_executables(bindir=UNDEFINED):
     return commands
 
 
+ENTRY_POINTS_SOURCE = """\
+import json
+from importlib import metadata
+entry_points = metadata.entry_points()
+if hasattr(entry_points, 'select'):
+    entry_points = entry_points.select(group='console_scripts')
+else:
+    entry_points = entry_points.get('console_scripts', ())
+print(json.dumps({entry_point.name: entry_point.value for entry_point in entry_points}))
+"""
+
+
+def get_entry_points(venv_bin_dir):
+    """Get the console_scripts entry points installed in the virtualenv"""
+    python_exe = Path(venv_bin_dir) / "python"
+    result = subprocess.run([str(python_exe), "-c", ENTRY_POINTS_SOURCE],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+    if result.returncode:
+        return {}
+    try:
+        return json.loads(str(result.stdout, 'utf-8'))
+    except ValueError:
+        return {}
+
+
+def make_command_index(venv_bin_dir, installed_commands):
+    """Scan the virtualenv bin dir and make the command index"""
+    venv_bin_dir = Path(venv_bin_dir)
+    bin_dir_mtime = venv_bin_dir.stat().st_mtime_ns
+    entry_points = get_entry_points(venv_bin_dir)
+    installed_commands = set(installed_commands)
+    commands = {}
+    for command in find_executables(venv_bin_dir):
+        commands[command] = {
+            'path': str(venv_bin_dir.resolve() / command),
+            'entry_point': entry_points.get(command, None),
+            'installed': command in installed_commands,
+        }
+    return {
+        'bin_dir_mtime': bin_dir_mtime,
+        'commands': commands,
+    }
+
+
+def write_command_index(install_dir, index):
+    """Write the command index"""
+    index_path = Path(install_dir) / 'bentobox-commands.json'
+    with open(index_path, 'w') as index_file:
+        print(json.dumps(index, indent=4, sort_keys=True), file=index_file)
+
+
+def get_command_index(config):
+    """Get the command index; the bin dir is scanned only if the index is missing or stale"""
+    index_path = Path(config['install_dir']) / 'bentobox-commands.json'
+    venv_bin_dir = Path(config['venv_bin_dir'])
+    try:
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = None
+    if index is None or index.get('bin_dir_mtime', None) != venv_bin_dir.stat().st_mtime_ns:
+        LOG.info("command index %s is missing or stale", index_path)
+        index = make_command_index(venv_bin_dir, config.get('installed_commands', ()))
+        try:
+            write_command_index(config['install_dir'], index)
+        except OSError as err:
+            LOG.warning("cannot write command index %s: %s", index_path, err)
+    return index
+
+
 def check_installed_command(command):
     """Check if a command is correctly installed"""
     config = get_config()
@@ -342,21 +915,41 @@ def _(obj):
     return obj.name
 
 
-def create_header(state, fill_len=None):
-    """Create the box-file header"""
+def create_header(state, header_size=None):
+    """Create the box-file header
+
+    The header is filled up to header_size bytes, which is recorded in its
+    second line; by default the size leaves room for the state to grow.
+    Returns None if the header does not fit in header_size bytes.
+    """
+    shebang = state['python_interpreter']
+    if state.get('runtime_cache', None):
+        shebang += ' ' + str(state['runtime_cache'])
     header = '''\
-#!{python_interpreter}
+#!{shebang}
+{header_size_line}
 
 # WARNING: this is a bentobox-generated file - do not edit!
 
 """
 {state_json}
 """
-'''.format(python_interpreter=state['python_interpreter'],
+'''.format(shebang=shebang,
+           header_size_line=HEADER_SIZE_LINE.format(0),
            state_json=json.dumps(tojson(state), indent=4))
-    if fill_len:
-        header += filler(fill_len)
-    return header
+    header_len = len(header.encode('utf-8'))
+    if header_size is None:
+        header_size = get_header_size(header_len)
+    elif header_len > header_size:
+        return None
+    header = header.replace(HEADER_SIZE_LINE.format(0), HEADER_SIZE_LINE.format(header_size), 1)
+    return header + filler(header_size - header_len)
+
+
+def get_header_size(header_len):
+    """Get the size of a header slot for header_len bytes, with room to grow"""
+    header_size = header_len + max(header_len, HEADER_FILL_LEN)
+    return -(-header_size // HEADER_BLOCK_SIZE) * HEADER_BLOCK_SIZE
 
 
 def get_archives():
@@ -468,12 +1061,29 @@ def set_write_mode(filename):
             filename.chmod(old_mode)
 
 
+def parse_header_size(line):
+    """Parse the header size line; returns None if it is not a header size line"""
+    line = str(line, 'utf-8', 'replace').rstrip('\n')
+    fields = line.split()
+    if len(fields) == 5 and fields[3].isdigit() and \
+            line == HEADER_SIZE_LINE.format(int(fields[3])):
+        return int(fields[3])
+    return None
+
+
 def get_header_len(output_path):
     """Get the header length"""
-    header_len = 0
-    with open(output_path, "r") as output_file:
+    with open(output_path, "rb") as output_file:
+        output_file.readline()
+        header_size = parse_header_size(output_file.readline())
+        if header_size is not None:
+            return header_size
+        # boxes created without a header slot: scan the header
+        output_file.seek(0)
+        header_len = 0
+        mark = MARK_END_OF_HEADER.encode('utf-8')
         for line in output_file:
-            if line.startswith(MARK_END_OF_HEADER):
+            if line.startswith(mark):
                 break
             header_len += len(line)
     return header_len
@@ -485,9 +1095,32 @@ def format_package_data(package_data):
         'package': '{type} {name}',
         'archive': '{type} {hash} [{name}]',
     }
+    if package_data['type'] == 'archive' and 'size' in package_data:
+        text = fmtd['archive'].format(**package_data) + ' {}'.format(
+            format_size(package_data['size']))
+        if package_data.get('codec', None):
+            text += ' ({}: {})'.format(package_data['codec'], format_size(package_data['length']))
+        if package_data.get('wheel_tags', None):
+            text += ' <{}>'.format(', '.join(package_data['wheel_tags']))
+        if package_data.get('dependency', False):
+            text += ' (dependency)'
+        return text
     return fmtd[package_data['type']].format(**package_data)
 
 
+def format_size(size):
+    """Return formatted size"""
+    for unit in 'B', 'KiB', 'MiB', 'GiB':
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+    if unit == 'B':
+        return '{}{}'.format(size, unit)
+    return '{:.1f}{}'.format(size, unit)
+
+
 def filler(fill_len, line_len=80):
     """Get fill lines"""
     if fill_len > 0:
@@ -503,70 +1136,137 @@ def filler(fill_len, line_len=80):
         return ''
 
 
+FICLONE = 0x40049409
+
+
+def clone_file(source_path, target_path):
+    """Copy a file, sharing its blocks (reflink) if the file system supports it
+
+    Falls back to an in-kernel copy (copy_file_range or sendfile), and
+    finally to a plain copy; the data never goes through python if possible.
+    """
+    with open(source_path, "rb") as source_file, open(target_path, "wb") as target_file:
+        try:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            copy_range(source_file, target_file, 0, os.fstat(source_file.fileno()).st_size)
+    shutil.copymode(source_path, target_path)
+
+
 def replace_state(output_path, state):
-    """Replace the box state"""
+    """Replace the box state
+
+    The state is written in the header slot, in place. If it does not fit,
+    the box is copied into a larger slot and renamed over the old one: the
+    data after the header never moves inside a file that running boxes may
+    have open (or mapped, as open_asset does).
+    """
     output_path = Path(output_path)
-    header = create_header(state)
-    in_place = False
-    if output_path.exists():
-        old_header_len = get_header_len(output_path)
-        if old_header_len >= len(header):
-            in_place = True
-            fill_len = old_header_len - len(header)
-            fill = filler(fill_len)
-            header += fill
-            assert len(header) == old_header_len
-
-    if in_place:
-        with set_write_mode(output_path), open(output_path, "r+") as output_file:
-            output_file.write(header)
-    else:
-        header += filler(fill_len=HEADER_FILL_LEN)
-        if not output_path.exists():
-            if not output_path.parent.is_dir():
-                output_path.parents.mkdir(parents=True)
-            shutil.copy(__file__, output_path)
-        with set_write_mode(output_path):
-            output_path_swp = output_path.with_name(output_path.name + ".swp")
-            if not output_path_swp.parent.is_dir():
-                output_path_swp.mkdir(parents=True)
-            try:
-                with open(output_path_swp, "w") as target_file, \
-                     open(output_path, "r") as source_file:
-                    target_file.write(header)
-                    status = 'skip'
-                    for line in source_file:
-                        if status == 'skip':
-                            if line.startswith(MARK_END_OF_HEADER):
-                                target_file.write(line)
-                                status = 'copy'
-                        else:
-                            target_file.write(line)
-            except:  # pylint: disable=bare-except
-                if output_path_swp.exists():
-                    output_path_swp.unlink()
-            else:
-                if output_path_swp.exists():
-                    output_path_swp.rename(output_path)
+    if not output_path.exists():
+        if not output_path.parent.is_dir():
+            output_path.parent.mkdir(parents=True)
+        clone_file(__file__, output_path)
+    header_size = get_header_len(output_path)
+    header = create_header(state, header_size)
+    with set_write_mode(output_path):
+        if header is not None:
+            with open(output_path, "r+b") as output_file:
+                output_file.write(header.encode('utf-8'))
+            return
+        header = create_header(state).encode('utf-8')
+        output_path_swp = output_path.with_name(output_path.name + ".swp")
+        try:
+            # the box may contain a binary payload
+            with open(output_path_swp, "wb") as target_file, \
+                 open(output_path, "rb") as source_file:
+                target_file.write(header)
+                copy_range(source_file, target_file, header_size,
+                           os.fstat(source_file.fileno()).st_size - header_size)
+            shutil.copymode(output_path, output_path_swp)
+        except:  # pylint: disable=bare-except
+            if output_path_swp.exists():
+                output_path_swp.unlink()
+            raise
+        output_path_swp.rename(output_path)
+
+
+def get_runtime_source(box_path=None):
+    """Get the box runtime source and the number of header lines preceding it"""
+    if box_path is None:
+        box_path = __file__
+    num_header_lines = 0
+    lines = []
+    with open(box_path, "r", errors="surrogateescape") as box_file:
+        for line in box_file:
+            if line.startswith(MARK_END_OF_HEADER):
+                lines.append(line)
+                break
+            num_header_lines += 1
+        for line in box_file:
+            lines.append(line)
+            if line.startswith(MARK_END_OF_SOURCE):
+                break
+    return num_header_lines, ''.join(lines)
+
 
+def make_runtime_hash(source):
+    """Make the hash of the box runtime source"""
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+RUNTIME_CACHE_SOURCE = """\
+import importlib.util, marshal, sys
+code = compile(sys.stdin.read(), sys.argv[1], 'exec')
+with open(sys.argv[2], 'wb') as cache_file:
+    cache_file.write(importlib.util.MAGIC_NUMBER + bytes(12) + marshal.dumps(code))
+"""
 
-def _update_box_header(printer, python_interpreter, verbose_level=None, debug=None):
+
+def _update_runtime_cache(printer, install_dir, python_interpreter):
+    """Write the cached runtime bytecode, if needed; returns its path"""
+    runtime_hash = STATE.get('runtime_hash', None)
+    if runtime_hash is None:
+        return None
+    num_header_lines, source = get_runtime_source()
+    if make_runtime_hash(source) != runtime_hash:
+        LOG.warning("box runtime does not match its hash, runtime cache disabled")
+        return None
+    cache_path = Path(install_dir).resolve() / (
+        RUNTIME_CACHE_PREFIX + runtime_hash + RUNTIME_CACHE_SUFFIX)
+    if not cache_path.is_file():
+        printer("writing runtime cache {}...".format(cache_path))
+        # the cached code keeps the line numbers of the box file
+        source = ("\n" * num_header_lines) + source
+        tmp_cache_path = cache_path.with_name(cache_path.name + ".tmp")
+        printer.run_command([str(python_interpreter), "-c", RUNTIME_CACHE_SOURCE,
+                             str(Path(__file__).resolve()), str(tmp_cache_path)],
+                            input=source.encode('utf-8'))
+        tmp_cache_path.rename(cache_path)
+    return cache_path
+
+
+def _update_box_header(printer, python_interpreter, runtime_cache=None,
+                       verbose_level=None, debug=None):
     """Update the box header in place"""
     verbose_level = get_verbose_level(verbose_level)
     debug = get_debug(debug)
     if not UPDATE_SHEBANG:
         return
-    if STATE['python_interpreter'] == python_interpreter:
+    if runtime_cache is not None:
+        runtime_cache = str(runtime_cache)
+    if STATE['python_interpreter'] == python_interpreter and \
+            STATE.get('runtime_cache', None) == runtime_cache:
         return
     printer("replacing shebang...")
     state = STATE.copy()
     state['python_interpreter'] = python_interpreter
-    replace_state(__file__, state)
+    state['runtime_cache'] = runtime_cache
+    replace_state(Path(__file__).resolve(), state)
 
 
 def configure(output_path, install_dir=UNDEFINED, wrap_info=UNDEFINED,
               verbose_level=UNDEFINED, debug=UNDEFINED, freeze=UNDEFINED,
-              update_shebang=UNDEFINED):
+              update_shebang=UNDEFINED, cache_runtime=UNDEFINED, zygote=UNDEFINED):
     """Change the STATE and update the file if necessary"""
     state = STATE.copy()
     if install_dir is not UNDEFINED:
@@ -585,9 +1285,112 @@ def configure(output_path, install_dir=UNDEFINED, wrap_info=UNDEFINED,
         state['freeze'] = freeze
     if update_shebang is not UNDEFINED:
         state['update_shebang'] = update_shebang
+    if cache_runtime is not UNDEFINED:
+        state['cache_runtime'] = cache_runtime
+        if not cache_runtime:
+            state['runtime_cache'] = None
+    if zygote is not UNDEFINED:
+        state['zygote'] = zygote
     replace_state(output_path, state)
 
 
+################################################################################
+### binary payload #############################################################
+################################################################################
+
+# A binary box is the box source, followed by the raw archives and by a
+# small zip file containing only this bootstrap as __main__.py: python runs
+# a zip file (even with arbitrary data before it) by running its __main__.py,
+# which compiles and runs the box source, never reading the payload.
+BOOTSTRAP_SOURCE = """\
+import sys
+
+
+def _bentobox_read_source(box_path):
+    mark = b"\\n" + {mark!r} + b"\\n"
+    data = b""
+    with open(box_path, "rb") as box_file:
+        while mark not in data:
+            chunk = box_file.read(65536)
+            if not chunk:
+                raise SyntaxError("{{}}: missing box source".format(box_path))
+            data += chunk
+    return data[:data.index(mark) + len(mark)]
+
+
+__file__ = sys.argv[0]
+exec(compile(_bentobox_read_source(__file__), __file__, "exec"))
+""".format(mark=MARK_END_OF_SOURCE.encode('utf-8'))
+
+COPY_BLOCK_SIZE = 1024 ** 2
+
+BASE64_SPAN_LEN = 4 * 1024 ** 2
+
+
+def make_bootstrap():
+    """Make the zip file running the source of a binary box"""
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, "w", zipfile.ZIP_STORED) as zip_file:
+        # a fixed date keeps the box reproducible
+        zip_info = zipfile.ZipInfo("__main__.py", date_time=(1980, 1, 1, 0, 0, 0))
+        zip_file.writestr(zip_info, BOOTSTRAP_SOURCE)
+    return zip_data.getvalue()
+
+
+def copy_range(source_file, target_file, offset, size):
+    """Copy size bytes at offset of source_file to target_file"""
+    source_fd = source_file.fileno()
+    target_fd = target_file.fileno()
+    target_file.flush()
+    for copy_function in getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None):
+        if copy_function is None:
+            continue
+        try:
+            while size > 0:
+                if copy_function is os.sendfile:
+                    num_bytes = os.sendfile(target_fd, source_fd, offset, size)
+                else:
+                    num_bytes = copy_function(source_fd, target_fd, size, offset)
+                if num_bytes == 0:
+                    raise BoxError("{}: unexpected end of file".format(source_file.name))
+                offset += num_bytes
+                size -= num_bytes
+            return
+        except OSError:
+            # not supported for these files: fall back
+            continue
+    source_file.seek(offset)
+    while size > 0:
+        data = source_file.read(min(size, COPY_BLOCK_SIZE))
+        if not data:
+            raise BoxError("{}: unexpected end of file".format(source_file.name))
+        target_file.write(data)
+        size -= len(data)
+
+
+def iter_payload(box_file):
+    """Iterate over the archives of a binary payload
+
+    Yields (archive_name, archive_hash, offset, size), where offset is the
+    absolute position of the archive data in box_file.
+    """
+    mark = MARK_PAYLOAD.encode('utf-8')
+    for line in box_file:
+        if line.startswith(mark):
+            break
+    offset = box_file.tell()
+    while True:
+        box_file.seek(offset)
+        if box_file.readline() != b"#\n":
+            break
+        archive_name = str(box_file.readline()[1:-1], 'utf-8')
+        archive_hash = str(box_file.readline()[1:-1], 'utf-8')
+        size = int(box_file.readline()[1:-1])
+        offset = box_file.tell()
+        yield archive_name, archive_hash, offset, size
+        offset += size
+
+
 ################################################################################
 ### exported functions #########################################################
 ################################################################################
@@ -598,51 +1401,208 @@ def _extract(printer, archives, output_dir):
         printer("creating output dir {}...".format(output_dir))
         output_dir.mkdir()
     printer("reading archives from {}...".format(__file__))
-    archive_paths = {}
-    archive_path = None
-    archive_file = None
     if archives is None:
         archives = [value[0] for value in get_archives()]
     archives = set(archives)
-    try:
-        with open(__file__, "r") as source_file:
-            for line in source_file:
-                if line.startswith(MARK_ARCHIVES):
-                    break
-            status = 'archive-name'
-            for line in source_file:
-                src = line[1:-1]
-                if not src:
-                    status = 'archive-name'
-                    continue
-                if status == 'archive-name':
-                    archive_name = src
-                    status = 'archive-hash'
-                elif status == 'archive-hash':
-                    archive_hash = src
-                    if archive_hash in archives:
-                        if archive_file:
-                            archive_file.close()
-                        archive_path = output_dir / archive_hash / archive_name
-                        if not archive_path.parent.is_dir():
-                            archive_path.parent.mkdir(parents=True)
-                        archive_paths[archive_hash] = archive_path
-                        printer("extracting archive {} [{}]...".format(archive_name, archive_hash))
-                        archive_file = open(archive_path, 'wb')
-                        status = 'archive-data'
-                    else:
-                        status = 'skip'
-                elif status == 'archive-data':
-                    data = b64decode(src)
-                    archive_file.write(data)
-                elif status == 'skip':
-                    pass
-    finally:
-        if archive_file:
-            archive_file.close()
+    archive_paths = {}
+    jobs = []
+    for archive_name, archive_hash, offset, length, codec in get_archive_table():
+        if archive_hash not in archives:
+            continue
+        archive_path = output_dir / archive_hash / archive_name
+        if not archive_path.parent.is_dir():
+            archive_path.parent.mkdir(parents=True)
+        archive_paths[archive_hash] = archive_path
+        printer("extracting archive {} [{}]...".format(archive_name, archive_hash))
+        jobs.append((archive_path, archive_hash, offset, length, codec))
+    missing = archives.difference(archive_paths)
+    if missing:
+        raise BoxError("{}: missing archives {}: the box is corrupted".format(
+            __file__, ", ".join(sorted(missing))))
+    map_jobs(_extract_archive, jobs)
     return archive_paths
 
 
+def get_archives_offset(box_path=None):
+    """Get the position of the archives section data in the box"""
+    if box_path is None:
+        box_path = __file__
+    source_len = len(read_box_source(box_path))
+    with open(box_path, "rb") as box_file:
+        box_file.seek(source_len)
+        box_file.readline()
+        return box_file.tell()
+
+
+def iter_range(box_file, offset, length):
+    """Iterate over the blocks of a byte range of the box"""
+    box_file.seek(offset)
+    while length > 0:
+        data = box_file.read(min(length, COPY_BLOCK_SIZE))
+        if not data:
+            raise BoxError("{}: unexpected end of file".format(box_file.name))
+        length -= len(data)
+        yield data
+
+
+def iter_text_archives(data):
+    """Iterate over the archives of the base64 archives section
+
+    Yields (archive_name, archive_hash, offset, length) for the line block
+    of each archive in data (the box content).
+    """
+    mark = ("\n" + MARK_ARCHIVES + "\n").encode('utf-8')
+    pos = data.find(mark)
+    if pos < 0:
+        return
+    pos += len(mark)
+    while data[pos:pos + 2] == b"#\n":
+        name_end = data.find(b"\n", pos + 2)
+        hash_end = data.find(b"\n", name_end + 1)
+        if name_end < 0 or hash_end < 0:
+            raise BoxError("{}: unexpected end of file".format(__file__))
+        archive_name = str(data[pos + 3:name_end], 'utf-8')
+        archive_hash = str(data[name_end + 2:hash_end], 'utf-8')
+        offset = hash_end + 1
+        end = data.find(b"\n#\n", hash_end)
+        if end < 0:
+            end = len(data)
+        else:
+            end += 1
+        yield archive_name, archive_hash, offset, end - offset
+        pos = end
+
+
+def iter_base64_block(data, offset, length, span_len=BASE64_SPAN_LEN):
+    """Decode the base64 line block of an archive, in large spans
+
+    Each span of whole lines is split and decoded at C level, with no python
+    loop over the lines (a2b_base64 discards the '#' line prefix).
+    """
+    end = offset + length
+    if end > len(data):
+        raise BoxError("{}: unexpected end of file".format(__file__))
+    while offset < end:
+        span_end = min(end, offset + span_len)
+        if span_end < end:
+            span_end = data.find(b"\n", span_end - 1) + 1
+        yield b"".join(map(binascii.a2b_base64, data[offset:span_end].split(b"\n")))
+        offset = span_end
+
+
+def iter_decompressed(codec, blocks, block_size=COPY_BLOCK_SIZE):
+    """Decompress a stream of blocks, yielding at most block_size bytes at a time"""
+    # pylint: disable=import-outside-toplevel
+    if codec == 'zlib':
+        import zlib
+        decompressor = zlib.decompressobj()
+        for data in blocks:
+            while data:
+                yield decompressor.decompress(data, block_size)
+                data = decompressor.unconsumed_tail
+        yield decompressor.flush()
+    elif codec in {'bz2', 'lzma'}:
+        if codec == 'bz2':
+            import bz2
+            decompressor = bz2.BZ2Decompressor()
+        else:
+            import lzma
+            decompressor = lzma.LZMADecompressor()
+        for data in blocks:
+            yield decompressor.decompress(data, block_size)
+            while not (decompressor.needs_input or decompressor.eof):
+                yield decompressor.decompress(b'', block_size)
+    else:
+        raise BoxError("unknown codec {!r}".format(codec))
+
+
+def get_archive_table(box_path=None):
+    """Return [(archive_name, archive_hash, offset, length, codec)...]
+
+    offset is the absolute position of the archive data in the box; boxes
+    without an offset table are scanned.
+    """
+    if box_path is None:
+        box_path = __file__
+    packages = [package_data for package_data in STATE['packages']
+                if package_data['type'] == 'archive']
+    if all('offset' in package_data for package_data in packages):
+        archives_offset = get_archives_offset(box_path)
+        return [(package_data['name'], package_data['hash'],
+                 archives_offset + package_data['offset'], package_data['length'],
+                 package_data.get('codec', None)) for package_data in packages]
+    with open(box_path, "rb") as box_file:
+        if STATE.get('box_format', 'text') == 'binary':
+            return [archive + (None,) for archive in iter_payload(box_file)]
+        with mmap.mmap(box_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return [archive + (None,) for archive in iter_text_archives(data)]
+
+
+def iter_archive(offset, length, codec=None, box_path=None):
+    """Iterate over the original data of an archive at a given position of the box"""
+    if box_path is None:
+        box_path = __file__
+    with contextlib.ExitStack() as stack:
+        box_file = stack.enter_context(open(box_path, "rb"))
+        if STATE.get('box_format', 'text') == 'binary':
+            blocks = iter_range(box_file, offset, length)
+        else:
+            data = stack.enter_context(
+                mmap.mmap(box_file.fileno(), 0, access=mmap.ACCESS_READ))
+            blocks = iter_base64_block(data, offset, length)
+        if codec is not None:
+            blocks = iter_decompressed(codec, blocks)
+        yield from blocks
+
+
+def hash_archive(offset, length, codec=None, archive_file=None):
+    """Hash an archive at a given position of the box
+
+    The data is written to archive_file (if any) as it is hashed.
+    """
+    hashobj = hashlib.new(STATE.get('hash_algorithm', 'sha1'))
+    for block in iter_archive(offset, length, codec):
+        hashobj.update(block)
+        if archive_file is not None:
+            archive_file.write(block)
+    return hashobj.hexdigest()
+
+
+def map_jobs(function, jobs, max_workers=8):
+    """Run function(*job) for each job, in a thread pool if there is more than one"""
+    if len(jobs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(jobs), max_workers)) as executor:
+            return list(executor.map(function, *zip(*jobs)))
+    return [function(*job) for job in jobs]
+
+
+def _extract_archive(archive_path, archive_hash, offset, length, codec=None):
+    """Extract an archive at a given position of the box, checking its hash"""
+    with open(archive_path, "wb") as archive_file:
+        if not VERIFY:
+            if codec is None and STATE.get('box_format', 'text') == 'binary':
+                with open(__file__, "rb") as box_file:
+                    copy_range(box_file, archive_file, offset, length)
+            else:
+                for block in iter_archive(offset, length, codec):
+                    archive_file.write(block)
+            return
+        actual_hash = hash_archive(offset, length, codec, archive_file=archive_file)
+    if actual_hash != archive_hash:
+        archive_path.unlink()
+        raise BoxError("archive {} [{}]: hash mismatch ({}): the box is corrupted".format(
+            archive_path.name, archive_hash, actual_hash))
+
+
+def _verify_archive(offset, length, codec=None):
+    """Return the hash of an archive, or the error raised reading it"""
+    try:
+        return hash_archive(offset, length, codec)
+    except Exception as err:  # pylint: disable=broad-except
+        return err
+
+
 def extract(archives, output_dir=None, verbose_level=None, debug=None):
     """Extract archives with a given hash"""
     if output_dir is None:
@@ -651,6 +1611,35 @@ def extract(archives, output_dir=None, verbose_level=None, debug=None):
         return _extract(printer, archives, output_dir)
 
 
+def verify(jobs=None, verbose_level=None, debug=None):
+    """Verify the archives hashes, without installing the box
+
+    Returns [(archive_name, archive_hash, error)...], where error is None
+    for the sound archives.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    with Printer(verbose_level=verbose_level, debug=debug) as printer:
+        printer("verifying archives of {}...".format(__file__))
+        table = get_archive_table() + get_asset_table()
+        actual_hashes = map_jobs(_verify_archive, [archive[2:] for archive in table],
+                                 max_workers=jobs)
+    result = []
+    for (archive_name, archive_hash, *_), actual_hash in zip(table, actual_hashes):
+        if isinstance(actual_hash, Exception):
+            error = str(actual_hash)
+        elif actual_hash != archive_hash:
+            error = "hash mismatch ({})".format(actual_hash)
+        else:
+            error = None
+        result.append((archive_name, archive_hash, error))
+    found = {archive[1] for archive in table}
+    for archive_hash, archive_name in get_archives():
+        if archive_hash not in found:
+            result.append((archive_name, archive_hash, "missing"))
+    return result
+
+
 def check(install_dir=None):
     """Verify the box"""
     if install_dir is None:
@@ -663,6 +1652,307 @@ def check(install_dir=None):
         check_wrap_info(wrap_info)
 
 
+################################################################################
+### assets #####################################################################
+################################################################################
+
+def get_assets(state=STATE):
+    """Return the asset data list"""
+    return state.get('assets', None) or []
+
+
+def get_asset_table():
+    """Return [(asset_name, asset_hash, offset, length, codec)...] (as get_archive_table)"""
+    assets = get_assets()
+    if not assets:
+        return []
+    archives_offset = get_archives_offset()
+    return [(asset_data['name'], asset_data['hash'], archives_offset + asset_data['offset'],
+             asset_data['length'], asset_data.get('codec', None)) for asset_data in assets]
+
+
+def _extract_assets(printer, assets_dir):
+    """Extract the assets (one copy, outside the virtualenv)"""
+    if not assets_dir.is_dir():
+        assets_dir.mkdir(parents=True)
+    jobs = []
+    for asset_name, asset_hash, offset, length, codec in get_asset_table():
+        printer("extracting asset {} [{}]...".format(asset_name, asset_hash))
+        jobs.append((assets_dir / asset_name, asset_hash, offset, length, codec))
+    map_jobs(_extract_archive, jobs)
+
+
+def _get_asset_data(name):
+    for asset_data in get_assets():
+        if asset_data['name'] == name:
+            return asset_data
+    raise BoxError("missing asset {}".format(name))
+
+
+def get_asset_path(name):
+    """Get the path of the extracted asset name"""
+    _get_asset_data(name)
+    return get_install_dir() / ASSETS_DIR / name
+
+
+def open_asset(name):
+    """Return a read-only memoryview of the asset name
+
+    In binary boxes the view maps the box file itself, and the box needs
+    not be installed; otherwise it maps the copy extracted at install.
+    """
+    asset_data = _get_asset_data(name)
+    if STATE.get('box_format', 'text') == 'binary' and not asset_data.get('codec', None):
+        asset_path = __file__
+        offset = get_archives_offset() + asset_data['offset']
+    else:
+        asset_path = get_asset_path(name)
+        offset = 0
+    size = asset_data['size']
+    if size == 0:
+        return memoryview(b'')
+    # mmap offsets must be multiples of the allocation granularity
+    map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with open(asset_path, "rb") as asset_file:
+        data = mmap.mmap(asset_file.fileno(), offset + size - map_offset,
+                         access=mmap.ACCESS_READ, offset=map_offset)
+    return memoryview(data)[offset - map_offset:]
+
+
+################################################################################
+### wheels #####################################################################
+################################################################################
+
+# minimum glibc version of the legacy manylinux platform tags
+MANYLINUX_LEGACY_GLIBC = {'manylinux1': (2, 5), 'manylinux2010': (2, 12), 'manylinux2014': (2, 17)}
+RE_MANYLINUX = re.compile(r"^manylinux_(\d+)_(\d+)_(\w+)$")
+RE_MACOSX = re.compile(r"^macosx_(\d+)_(\d+)_(\w+)$")
+RE_PYTHON_TAG = re.compile(r"^([a-z]+)(\d)(\d*)$")
+
+
+def get_wheel_tags(wheel_name):
+    """Return the expanded tags (python-abi-platform) of a wheel file name"""
+    tag_sets = wheel_name[:-len(".whl")].split('-')[-3:]
+    return ['-'.join(tag) for tag in itertools.product(*(tags.split('.') for tags in tag_sets))]
+
+
+def _get_glibc_version():
+    try:
+        version = os.confstr('CS_GNU_LIBC_VERSION')  # 'glibc 2.31'
+        return tuple(int(num) for num in version.split()[1].split('.')[:2])
+    except (AttributeError, ValueError, OSError, IndexError):
+        return None
+
+
+def _get_abi_tag():
+    soabi = sysconfig.get_config_var('SOABI') or ''
+    if soabi.startswith('cpython-'):
+        return 'cp' + soabi.split('-')[1]  # 'cpython-39-x86_64-linux-gnu'
+    return '_'.join(soabi.split('-')[:2]).replace('.', '_')  # 'pypy39-pp73-...'
+
+
+def is_supported_platform_tag(platform_tag):
+    """Check if a wheel platform tag matches the current platform"""
+    platform = sysconfig.get_platform().replace('-', '_').replace('.', '_')
+    if platform_tag in ('any', platform):
+        return True
+    if platform.startswith('linux_'):
+        arch = platform[len('linux_'):]
+        glibc_version = _get_glibc_version()
+        if glibc_version is None:
+            return False
+        prefix, _, tag_arch = platform_tag.partition('_')
+        if prefix in MANYLINUX_LEGACY_GLIBC:
+            return tag_arch == arch and glibc_version >= MANYLINUX_LEGACY_GLIBC[prefix]
+        match = RE_MANYLINUX.match(platform_tag)
+        return bool(match) and match.group(3) == arch and \
+            glibc_version >= (int(match.group(1)), int(match.group(2)))
+    match = RE_MACOSX.match(platform_tag)
+    current_match = RE_MACOSX.match(platform)
+    if match and current_match:
+        arch = current_match.group(3)
+        archs = {arch, 'universal2'} if arch in ('x86_64', 'arm64') else {arch}
+        tag_version = (int(match.group(1)), int(match.group(2)))
+        current_version = (int(current_match.group(1)), int(current_match.group(2)))
+        return match.group(3) in archs and tag_version <= current_version
+    return False
+
+
+def is_supported_wheel_tag(tag):
+    """Check if a wheel tag (python-abi-platform) matches the current interpreter"""
+    python_tag, abi_tag, platform_tag = tag.split('-')
+    match = RE_PYTHON_TAG.match(python_tag)
+    if not match:
+        return False
+    implementation = {'cpython': 'cp', 'pypy': 'pp'}.get(
+        sys.implementation.name, sys.implementation.name)
+    tag_implementation, tag_major, tag_minor = match.groups()
+    if tag_implementation not in ('py', implementation) or \
+            int(tag_major) != sys.version_info[0] or \
+            (tag_minor and int(tag_minor) > sys.version_info[1]):
+        return False
+    if abi_tag == 'abi3':
+        if implementation != 'cp' or tag_implementation != 'cp':
+            return False
+    elif abi_tag != 'none':
+        if abi_tag != _get_abi_tag() or int(tag_minor or -1) != sys.version_info[1]:
+            return False
+    return is_supported_platform_tag(platform_tag)
+
+
+def check_wheels(state=STATE):
+    """Check that the wheels of the box match the current interpreter"""
+    for package_data in state['packages']:
+        wheel_tags = package_data.get('wheel_tags', None)
+        if wheel_tags and not any(is_supported_wheel_tag(tag) for tag in wheel_tags):
+            raise BoxError("wheel {} ({}) does not match python {}".format(
+                package_data['name'], ', '.join(wheel_tags), sys.executable))
+
+
+################################################################################
+### freeze #####################################################################
+################################################################################
+
+def get_python_libraries(python_exe):
+    """Get the paths of the python executable and of its stdlib extension modules"""
+    paths = [Path(python_exe).resolve()]
+    lib_dynload = Path(sysconfig.get_path('platstdlib')) / 'lib-dynload'
+    if lib_dynload.is_dir():
+        paths.extend(sorted(lib_dynload.glob('*.so')))
+    return paths
+
+
+def get_shared_libraries(paths, lib_path=None):
+    """Get the shared libraries resolved by the dynamic loader for paths
+
+    Returns a dict {library name: library path, or 'not found'}, or None if
+    ldd is not available.
+    """
+    environ = os.environ.copy()
+    environ.pop('LD_LIBRARY_PATH', None)
+    if lib_path:
+        environ['LD_LIBRARY_PATH'] = lib_path
+    try:
+        result = subprocess.run(["ldd"] + [str(path) for path in paths], env=environ,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, check=False)
+    except OSError:
+        return None
+    libraries = {}
+    for line in result.stdout.splitlines():
+        name, sep, location = line.strip().partition(" => ")
+        if sep:
+            libraries[name] = location.split(" (")[0].strip()
+    return libraries
+
+
+def get_library_dirs(python_exe, lib_path):
+    """Get the directories of lib_path actually providing the python shared libraries
+
+    The directories keep the lib_path order, so that the libraries are
+    resolved in the same way.
+    """
+    lib_dirs = [lib_dir for lib_dir in lib_path.split(':') if lib_dir]
+    libraries = get_shared_libraries(get_python_libraries(python_exe), ':'.join(lib_dirs))
+    if libraries is None:
+        return lib_dirs
+    locations = [os.path.normpath(location) for location in libraries.values()
+                 if location.startswith('/')]
+    needed_dirs = []
+    for lib_dir in lib_dirs:
+        prefix = os.path.join(os.path.normpath(lib_dir), '')
+        if any(location.startswith(prefix) for location in locations):
+            needed_dirs.append(lib_dir)
+    return needed_dirs
+
+
+def make_env_shebang(python_interpreter, lib_path):
+    """Make a shebang setting the LD_LIBRARY_PATH through 'env -S'"""
+    return ENV_SHEBANG_PREFIX + lib_path + ENV_SHEBANG_SUFFIX + python_interpreter
+
+
+ENV_SHEBANG_PROBE_SOURCE = """\
+import os, sys
+sys.exit(0 if os.environ.get('LD_LIBRARY_PATH', '').startswith({lib_path!r}) else 1)
+"""
+
+
+def has_env_shebang(python_interpreter, lib_path, install_dir):
+    """Tell if an 'env -S' shebang can be used
+
+    The shebang is probed by running a script in install_dir, with a
+    python argument as long as the runtime cache path: kernels older than
+    5.1 silently truncate shebang lines longer than 127 bytes, and
+    /usr/bin/env may not support '-S'.
+    """
+    if any(char.isspace() or char in '\\$"\'' for char in lib_path):
+        return False
+    install_dir = Path(install_dir).resolve()
+    runtime_cache_name = RUNTIME_CACHE_PREFIX + make_runtime_hash('') + RUNTIME_CACHE_SUFFIX
+    probe_source = install_dir / "bentobox-probe".ljust(len(runtime_cache_name) - 3, '-')
+    probe_source = probe_source.with_name(probe_source.name + ".py")
+    probe_script = install_dir / "bentobox-probe"
+    try:
+        with open(probe_source, "w") as source_file:
+            source_file.write(ENV_SHEBANG_PROBE_SOURCE.format(lib_path=lib_path + ':'))
+        with open(probe_script, "w") as script_file:
+            script_file.write("#!{} {}\n".format(
+                make_env_shebang(str(python_interpreter), lib_path), probe_source))
+        probe_script.chmod(0o755)
+        result = subprocess.run([str(probe_script)], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, check=False)
+    except OSError:
+        return False
+    finally:
+        for path in probe_source, probe_script:
+            if path.exists():
+                path.unlink()
+    return result.returncode == 0
+
+
+def get_freeze_mode(python_exe, lib_path, install_dir, update_shebang=True):
+    """Detect how the python library path must be frozen
+
+    * 'none': the python libraries resolve in the same way without lib_path;
+    * 'environ': the box shebang sets LD_LIBRARY_PATH through 'env -S'
+      (only if the shebang is updated);
+    * 'wrapper': the virtualenv python is replaced by a bash wrapper.
+    """
+    if not lib_path:
+        return 'none'
+    paths = get_python_libraries(python_exe)
+    libraries = get_shared_libraries(paths, lib_path)
+    if libraries is not None and libraries == get_shared_libraries(paths):
+        return 'none'
+    if update_shebang and has_env_shebang(python_exe, lib_path, install_dir):
+        return 'environ'
+    return 'wrapper'
+
+
+def freeze_python(printer, venv_bin_dir, python_name, lib_path):
+    """Replace the virtualenv python with a wrapper setting the LD_LIBRARY_PATH"""
+    python_exe = venv_bin_dir / python_name
+    if python_exe.exists():
+        printer("freezing python {}...".format(python_name))
+        if python_exe.is_symlink():
+            python_actual_exe = python_exe.resolve()
+            python_exe.unlink()
+        else:
+            python_actual_exe = venv_bin_dir / ("bentobox-" + python_name)
+            python_exe.rename(python_actual_exe)
+        python_wrapper_source = """\
+#!/bin/bash
+
+export LD_LIBRARY_PATH="{python_libs}${{LD_LIBRARY_PATH:+:${{LD_LIBRARY_PATH}}}}"
+exec {python_exe} "$@"
+""".format(python_exe=python_actual_exe, python_libs=lib_path)
+        with open(python_exe, "w") as fhandle:
+            fhandle.write(python_wrapper_source)
+        python_exe.chmod(python_actual_exe.stat().st_mode)
+        return python_exe
+    return None
+
+
 def install(env_file=None, reinstall=None, verbose_level=None, debug=None, update_shebang=None):
     """Install the box, if needed"""
     debug = get_debug(debug)
@@ -674,6 +1964,7 @@ def install(env_file=None, reinstall=None, verbose_level=None, debug=None, updat
     archives_dir = install_dir / "archives"
     bentobox_config_file = install_dir / "bentobox-config.json"
     bentobox_env_file = install_dir / "bentobox-env.sh"
+    bentobox_stamp_file = install_dir / "bentobox-stamp"
 
     if env_file is None:
         source_file = bentobox_env_file.resolve()
@@ -694,8 +1985,13 @@ def install(env_file=None, reinstall=None, verbose_level=None, debug=None, updat
         'packages': STATE['packages'],
     }
 
+    fingerprint = STATE.get('fingerprint', None)
     do_install = True
-    if bentobox_config_file.exists() and not FORCE_REINSTALL:
+    if FORCE_REINSTALL:
+        pass
+    elif not reinstall and fingerprint is not None and get_stamp(install_dir) == fingerprint:
+        do_install = False
+    elif bentobox_config_file.exists():
         with open(bentobox_config_file, "r") as fconfig:
             installed_config = json.load(fconfig)
         if reinstall:
@@ -727,32 +2023,14 @@ def install(env_file=None, reinstall=None, verbose_level=None, debug=None, updat
                     return None
             else:
                 do_install = False
+                if fingerprint is not None:
+                    with open(bentobox_stamp_file, "w") as fhandle:
+                        fhandle.write(fingerprint)
 
     with Printer(verbose_level=verbose_level, debug=debug) as printer:
 
         if do_install:
-            def freeze_python(printer, venv_bin_dir, python_name):
-                python_exe = venv_bin_dir / python_name
-                if python_exe.exists():
-                    printer("freezing python {}...".format(python_name))
-                    if python_exe.is_symlink():
-                        python_actual_exe = python_exe.resolve()
-                        python_exe.unlink()
-                    else:
-                        python_actual_exe = venv_bin_dir / ("bentobox-" + python_name)
-                        python_exe.rename(python_actual_exe)
-                    python_wrapper_source = """\
-#!/bin/bash
-
-export LD_LIBRARY_PATH="${{LD_LIBRARY_PATH}}:{python_libs}"
-exec {python_exe} "$@"
-""".format(python_exe=python_actual_exe, python_libs=os.environ.get('LD_LIBRARY_PATH', ''))
-                    with open(python_exe, "w") as fhandle:
-                        fhandle.write(python_wrapper_source)
-                    python_exe.chmod(python_actual_exe.stat().st_mode)
-                    return python_exe
-                return None
-
+            check_wheels()
             try:
                 if bentobox_config_file.exists():
                     printer("removing install dir {}...".format(install_dir))
@@ -762,12 +2040,23 @@ exec {python_exe} "$@"
                     archives_dir.mkdir(parents=True)
 
                 archive_paths = _extract(printer, None, archives_dir)
+                if get_assets():
+                    _extract_assets(printer, install_dir / ASSETS_DIR)
 
                 printer("creating virtualenv {}...".format(venv_dir))
                 venv.create(venv_dir, with_pip=True)
                 if FREEZE:
-                    for python_name in 'python3', 'python':
-                        freeze_python(printer, venv_bin_dir, python_name)
+                    lib_path = ':'.join(get_library_dirs(
+                        venv_bin_dir / "python3", os.environ.get('LD_LIBRARY_PATH', '')))
+                    freeze_mode = get_freeze_mode(venv_bin_dir / "python3", lib_path, install_dir,
+                                                  update_shebang=update_shebang)
+                    printer("freeze mode: {}".format(freeze_mode))
+                    config['freeze_mode'] = freeze_mode
+                    if freeze_mode != 'none':
+                        config['freeze_lib_path'] = lib_path
+                    if freeze_mode == 'wrapper':
+                        for python_name in 'python3', 'python':
+                            freeze_python(printer, venv_bin_dir, python_name, lib_path)
                 base_commands = set(find_executables(venv_bin_dir))
 
                 pip_path = venv_bin_dir / "pip"
@@ -775,9 +2064,16 @@ exec {python_exe} "$@"
                 environ = get_environ(config)
 
                 pip_install_args = list(STATE['pip_install_args'])
+                if STATE.get('bundle_deps', False):
+                    # offline install: pip finds the packages in the extracted archives only
+                    pip_install_args.append("--no-index")
+                    for archive_dir in sorted({path.parent for path in archive_paths.values()}):
+                        pip_install_args.extend(["--find-links", str(archive_dir)])
                 for package_data in STATE['packages']:
                     package_type = package_data['type']
                     package_name = package_data['name']
+                    if package_data.get('dependency', False):
+                        continue
                     if package_type == 'package':
                         printer("installing package {}...".format(package_name))
                         cmdline = [str(pip_path), "install"] + pip_install_args + [package_name]
@@ -793,6 +2089,10 @@ exec {python_exe} "$@"
                 installed_commands = set(find_executables(venv_bin_dir)).difference(base_commands)
                 config["installed_commands"] = sorted(installed_commands)
 
+                printer("creating command index...")
+                write_command_index(install_dir,
+                                    make_command_index(venv_bin_dir, installed_commands))
+
                 printer("creating activate file {}...".format(bentobox_env_file))
                 with open(bentobox_env_file, "w") as fhandle:
                     fhandle.write("""\
@@ -801,9 +2101,18 @@ exec {python_exe} "$@"
 
 export PATH="${{PATH}}:{venv_bin_dir}"
 """.format(venv_bin_dir=venv_bin_dir, **STATE))
+                    for var_name, var_value in get_asset_environ(install_dir, STATE).items():
+                        fhandle.write("export {}={}\n".format(var_name, shlex.quote(var_value)))
+                    if config.get('freeze_mode', None) == 'environ':
+                        fhandle.write("""\
+export LD_LIBRARY_PATH="{lib_path}${{LD_LIBRARY_PATH:+:${{LD_LIBRARY_PATH}}}}"
+""".format(lib_path=config['freeze_lib_path']))
                 printer("creating config file {}...".format(bentobox_config_file))
                 with open(bentobox_config_file, "w") as fhandle:
                     print(json.dumps(tojson(config), indent=4, sort_keys=True), file=fhandle)
+                if fingerprint is not None:
+                    with open(bentobox_stamp_file, "w") as fhandle:
+                        fhandle.write(fingerprint)
             except:  # pylint: disable=bare-except
                 shutil.rmtree(install_dir, ignore_errors=True)
                 raise
@@ -815,13 +2124,21 @@ export PATH="${{PATH}}:{venv_bin_dir}"
             shutil.copyfile(bentobox_env_file, env_file)
 
         if update_shebang:
+            installed_config = config if do_install else (get_config() or {})
             python_interpreter = sys.executable
+            runtime_cache = None
             for python_name in 'python3', 'python':
                 python_exe = venv_bin_dir / python_name
                 if python_exe.is_file():
                     python_interpreter = python_exe
+                    if CACHE_RUNTIME:
+                        runtime_cache = _update_runtime_cache(printer, install_dir, python_exe)
                     break
-            _update_box_header(printer, str(python_interpreter),
+            python_interpreter = str(python_interpreter)
+            if installed_config.get('freeze_mode', None) == 'environ':
+                python_interpreter = make_env_shebang(python_interpreter,
+                                                      installed_config['freeze_lib_path'])
+            _update_box_header(printer, python_interpreter, runtime_cache=runtime_cache,
                                verbose_level=verbose_level, debug=debug)
 
     if not do_install:
@@ -829,16 +2146,318 @@ export PATH="${{PATH}}:{venv_bin_dir}"
     return do_install, config
 
 
-def show(mode='text'):
+def get_wrapped_commands(config, state=STATE):
+    """Get the list of commands wrapped by the box"""
+    wrap_mode = state['wrap_mode']
+    if wrap_mode is WrapMode.SINGLE:
+        return [state['wraps']]
+    if wrap_mode is WrapMode.MULTIPLE:
+        return list(state['wraps'].values())
+    if wrap_mode is WrapMode.ALL:
+        return list(config.get('installed_commands', ()))
+    return []
+
+
+def _zygote_worker(request, fds):
+    """Run a zygote request in a forked worker"""
+    status = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for target_fd, source_fd in enumerate(fds):
+            os.dup2(source_fd, target_fd)
+            os.close(source_fd)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['environ'])
+        sys.argv = request['argv']
+        status = call_entry_point(request['entry_point'])
+    finally:
+        for stream in sys.stdout, sys.stderr:
+            try:
+                stream.flush()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        os._exit(status)  # pylint: disable=protected-access
+
+
+def zygote_serve(idle_timeout=None):
+    """Run the zygote server
+
+    The modules of the wrapped entry points are imported once; then a
+    worker is forked for each request received on the unix socket in the
+    install dir. The server exits after idle_timeout seconds without
+    requests.
+    """
+    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    if idle_timeout is None:
+        idle_timeout = ZYGOTE_IDLE_TIMEOUT
+    config = get_config()
+    if config is None:
+        raise BoxError("cannot start zygote server: box not installed")
+    if not has_zygote_support():
+        raise BoxError("cannot start zygote server: python 3.9 or later is required")
+    install_dir = Path(config['install_dir'])
+    socket_path = get_zygote_socket_path(install_dir)
+    if socket_path is None:
+        raise BoxError("cannot start zygote server: install dir path is too long")
+    lock_path = install_dir / "bentobox-zygote.lock"
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            LOG.info("zygote server already running")
+            return 0
+
+        index = get_command_index(config)
+        for command in get_wrapped_commands(config):
+            entry_point = index['commands'].get(command, {}).get('entry_point', None)
+            if entry_point:
+                try:
+                    load_entry_point(entry_point)
+                except Exception as err:  # pylint: disable=broad-except
+                    LOG.warning("cannot preload entry point %s: %s", entry_point, err)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        bound_ino = os.stat(socket_path).st_ino
+        server.listen()
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        signal.set_wakeup_fd(wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        os.chdir("/")
+        LOG.info("zygote server listening on %s", socket_path)
+        workers = {}
+        last_activity = time.monotonic()
+        running = True
+        try:
+            while running or workers:
+                timeout = None
+                if not workers:
+                    timeout = idle_timeout - (time.monotonic() - last_activity)
+                    if timeout <= 0:
+                        break
+                    # the install dir may be removed (uninstall, reinstall)
+                    try:
+                        if os.stat(socket_path).st_ino != bound_ino:
+                            break
+                    except OSError:
+                        break
+                    timeout = min(timeout, ZYGOTE_CHECK_INTERVAL)
+                for key, _ in selector.select(timeout):
+                    if key.fileobj == wakeup_r:
+                        while True:
+                            try:
+                                if not os.read(wakeup_r, 512):
+                                    break
+                            except BlockingIOError:
+                                break
+                        continue
+                    conn, _ = server.accept()
+                    last_activity = time.monotonic()
+                    fds = []
+                    try:
+                        peercred = getattr(socket, 'SO_PEERCRED', None)
+                        if peercred is not None:
+                            creds = conn.getsockopt(socket.SOL_SOCKET, peercred,
+                                                    struct.calcsize('3i'))
+                            if struct.unpack('3i', creds)[1] != os.getuid():
+                                LOG.warning("zygote: rejected connection from another user")
+                                conn.close()
+                                continue
+                        prefix, fds, _, _ = socket.recv_fds(conn, 4, 3)
+                        payload = _recv_exactly(conn, int.from_bytes(prefix, 'big'))
+                        request = json.loads(str(payload, 'utf-8'))
+                        if request.get('stop', False):
+                            running = False
+                            conn.close()
+                            continue
+                        if len(fds) != 3:
+                            raise BoxError("zygote: bad request")
+                        pid = os.fork()
+                        if pid == 0:
+                            for fileobj in [server, conn, lock_file] + list(workers.values()):
+                                fileobj.close()
+                            selector.close()
+                            os.close(wakeup_r)
+                            os.close(wakeup_w)
+                            _zygote_worker(request, fds)
+                        _send_message(conn, {'pid': pid})
+                        workers[pid] = conn
+                    except Exception as err:  # pylint: disable=broad-except
+                        LOG.warning("zygote: request failed: %s", err)
+                        conn.close()
+                    finally:
+                        for fd in fds:
+                            os.close(fd)
+                while workers:
+                    pid, wait_status = os.waitpid(-1, os.WNOHANG)
+                    if pid == 0:
+                        break
+                    conn = workers.pop(pid, None)
+                    if conn is not None:
+                        try:
+                            _send_message(conn, {'status': os.waitstatus_to_exitcode(wait_status)})
+                        except OSError:
+                            pass
+                        conn.close()
+                    last_activity = time.monotonic()
+        finally:
+            selector.close()
+            server.close()
+            signal.set_wakeup_fd(-1)
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+            try:
+                if os.stat(socket_path).st_ino == bound_ino:
+                    os.unlink(socket_path)
+            except OSError:
+                pass
+    LOG.info("zygote server stopped")
+    return 0
+
+
+def ensure_venv_python(config):
+    """Re-exec the box with the virtualenv python, if it is not running it"""
+    if os.path.realpath(sys.prefix) == os.path.realpath(config['venv_dir']):
+        os.environ.pop('BENTOBOX_VENV_REEXEC', None)
+        return
+    if os.environ.get('BENTOBOX_VENV_REEXEC', None):
+        raise BoxError("cannot run the box with the virtualenv python")
+    python = str(Path(config['venv_bin_dir']) / "python")
+    environ = os.environ.copy()
+    environ['BENTOBOX_VENV_REEXEC'] = '1'
+    LOG.info("running the box with %s...", python)
+    os.execve(python, [python, str(Path(__file__).resolve())] + sys.argv[1:], environ)
+
+
+def read_batch(batch_file):
+    """Read the argument vectors of a batch
+
+    Each non-empty line is a json array of strings, or a shell-quoted
+    argument list; lines starting with '#' are ignored.
+    """
+    for line in batch_file:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('['):
+            args = json.loads(line)
+            if not all(isinstance(arg, str) for arg in args):
+                raise BoxError("invalid batch line {!r}".format(line))
+        else:
+            args = shlex.split(line)
+        yield args
+
+
+def _run_batch_item(entry_point, argv):
+    """Run a single batch item; returns (status, elapsed)"""
+    sys.argv = list(argv)
+    start = time.perf_counter()
+    status = call_entry_point(entry_point)
+    elapsed = time.perf_counter() - start
+    for stream in sys.stdout, sys.stderr:
+        stream.flush()
+    return status, elapsed
+
+
+def run_batch(config, command, batch, results='-', jobs=None):
+    """Run many invocations of an installed command in a single interpreter
+
+    If jobs is set, the invocations are run by a pool of jobs forked
+    workers. A json line with the exit status and the elapsed time of each
+    invocation is written to the results file; if results is '-' they are
+    written to stdout, and the output of the invocations goes to stderr.
+    """
+    # pylint: disable=import-outside-toplevel
+    command_info = get_command_index(config)['commands'].get(command, None)
+    if command_info is None:
+        raise BoxError("missing command {}".format(command))
+    entry_point = command_info['entry_point']
+    if not entry_point:
+        raise BoxError("command {} has no entry point".format(command))
+    ensure_venv_python(config)
+    os.environ.update(get_environ(config))
+    load_entry_point(entry_point)
+
+    with contextlib.ExitStack() as stack:
+        if str(batch) == '-':
+            batch_file = sys.stdin
+        else:
+            batch_file = stack.enter_context(open(batch, "r"))
+        if str(results) == '-':
+            # the results own the standard output: the output of the items
+            # (including forked workers and subprocesses) goes to stderr
+            sys.stdout.flush()
+            saved_stdout_fd = os.dup(1)
+            stack.callback(os.close, saved_stdout_fd)
+            stack.callback(os.dup2, saved_stdout_fd, 1)
+            stack.callback(sys.stdout.flush)
+            results_file = stack.enter_context(os.fdopen(os.dup(1), "w"))
+            os.dup2(2, 1)
+        else:
+            results_file = stack.enter_context(open(results, "w"))
+        argvs = ([command_info['path']] + args for args in read_batch(batch_file))
+        if jobs:
+            argvs = list(argvs)
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, mp_context=multiprocessing.get_context('fork')))
+            outcomes = zip(argvs, executor.map(_run_batch_item,
+                                               itertools.repeat(entry_point), argvs))
+        else:
+            outcomes = ((argv, _run_batch_item(entry_point, argv)) for argv in argvs)
+        num_failures = 0
+        for index, (argv, (status, elapsed)) in enumerate(outcomes):
+            if status:
+                num_failures += 1
+            print(json.dumps({
+                'index': index,
+                'args': argv[1:],
+                'status': status,
+                'elapsed': elapsed,
+            }), file=results_file, flush=True)
+    if num_failures:
+        return 1
+    return 0
+
+
+def zygote_stop():
+    """Stop the zygote server, if running"""
+    config = get_config()
+    if config is None:
+        return
+    socket_path = get_zygote_socket_path(config['install_dir'])
+    if socket_path is None:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            _send_message(sock, {'stop': True})
+        except OSError:
+            LOG.info("zygote server not running")
+
+
+def show(mode='text', state=STATE):
     """Show command"""
     if mode == 'json':
-        print(json.dumps(tojson(STATE), indent=4))
+        print(json.dumps(tojson(state), indent=4))
     else:
-        if STATE['install_dir'] is None:
-            actual_install_dir = " [{}]".format(get_install_dir())
+        if state['install_dir'] is None:
+            actual_install_dir = " [{}]".format(get_install_dir(state))
         else:
             actual_install_dir = ""
-        box_type = get_box_type(STATE)
+        box_type = get_box_type(state)
         print("""\
 Box: {box_name} [{box_type}]
   + install_dir = {install_dir}{actual_install_dir}
@@ -846,10 +2465,16 @@ Box: {box_name} [{box_type}]
   + wraps = {wraps}
   + pip_install_args = {pip_install_args}
   + update_shebang = {update_shebang}
-  + packages:""".format(actual_install_dir=actual_install_dir, box_type=box_type, **STATE))
-        for package_data in STATE['packages']:
+  + packages:""".format(actual_install_dir=actual_install_dir, box_type=box_type, **state))
+        for package_data in state['packages']:
             print("""\
     - {}""".format(format_package_data(package_data)))
+        assets = get_assets(state)
+        if assets:
+            print("  + assets:")
+            for asset_data in assets:
+                print("    - asset {} [{}] {}".format(
+                    asset_data['name'], asset_data['hash'], format_size(asset_data['size'])))
 
 
 ################################################################################
@@ -857,11 +2482,13 @@ Box: {box_name} [{box_type}]
 ################################################################################
 
 def cmd_configure(output_path, install_dir, wrap_info=UNDEFINED, update_shebang=UNDEFINED,
-                  verbose_level=UNDEFINED, debug=UNDEFINED, freeze=UNDEFINED):
+                  verbose_level=UNDEFINED, debug=UNDEFINED, freeze=UNDEFINED,
+                  cache_runtime=UNDEFINED, zygote=UNDEFINED):
     """Configure command"""
     return configure(output_path, install_dir, wrap_info=wrap_info,
                      verbose_level=verbose_level, debug=debug,
-                     update_shebang=update_shebang, freeze=freeze)
+                     update_shebang=update_shebang, freeze=freeze,
+                     cache_runtime=cache_runtime, zygote=zygote)
 
 
 def cmd_extract(archives, output_dir=None, verbose_level=None, debug=None):
@@ -875,6 +2502,21 @@ def cmd_extract(archives, output_dir=None, verbose_level=None, debug=None):
         debug=debug)
 
 
+def cmd_verify(jobs=None, verbose_level=None, debug=None):
+    """Verify command"""
+    verbose_level = get_verbose_level(verbose_level)
+    debug = get_debug(debug)
+    result = 0
+    for archive_name, archive_hash, error in verify(
+            jobs=jobs, verbose_level=verbose_level, debug=debug):
+        if error is None:
+            print("{} [{}]: ok".format(archive_name, archive_hash))
+        else:
+            print("{} [{}]: FAILED: {}".format(archive_name, archive_hash, error))
+            result = 1
+    return result
+
+
 def cmd_install(env_file, reinstall=False, update_shebang=None, verbose_level=None, debug=None):
     """Install command"""
     verbose_level = get_verbose_level(verbose_level)
@@ -929,20 +2571,66 @@ def cmd_show(mode='text'):
     show(mode=mode)
 
 
+def cmd_link(directory=None, force=False, verbose_level=None, debug=None):
+    """Link command"""
+    verbose_level = get_verbose_level(verbose_level)
+    debug = get_debug(debug)
+    wrap_mode = STATE['wrap_mode']
+    if wrap_mode is WrapMode.MULTIPLE:
+        commands = sorted(STATE['wraps'])
+    elif wrap_mode is WrapMode.ALL:
+        _, config = install(verbose_level=verbose_level, debug=debug, reinstall=None)
+        if config is None:
+            return 1
+        commands = get_wrapped_commands(config)
+    else:
+        raise BoxError("cannot link commands: not a multiple-command box")
+
+    box_path = Path(__file__).resolve()
+    if directory is None:
+        directory = box_path.parent
+    result = 0
+    with Printer(verbose_level=verbose_level, debug=debug) as printer:
+        for command in commands:
+            link_path = directory / command
+            if link_path.is_symlink() or link_path.exists():
+                if link_path.resolve() == box_path:
+                    continue
+                if not force:
+                    LOG.error("cannot link command %s: %s already exists", command, link_path)
+                    result = 1
+                    continue
+                link_path.unlink()
+            printer("linking {} -> {}...".format(link_path, box_path))
+            link_path.symlink_to(box_path)
+    return result
+
+
 def cmd_list(what='commands'):
     """List command"""
     if what == 'commands':
         config = get_config()
         if config is None:
             raise ValueError("cannot list commands: box not installed")
-        for command in sorted(find_executables(config["venv_bin_dir"])):
+        for command in sorted(get_command_index(config)['commands']):
             print(command)
     elif what == 'packages':
         for pkg in STATE['packages']:
             print(format_package_data(pkg))
+    elif what == 'assets':
+        for asset_data in get_assets():
+            print("{} {}".format(asset_data['name'], get_asset_path(asset_data['name'])))
+
 
+def cmd_zygote(stop=False, idle_timeout=None):
+    """Zygote command"""
+    if stop:
+        return zygote_stop()
+    return zygote_serve(idle_timeout=idle_timeout)
 
-def cmd_run(command, args, verbose_level=None, debug=None, reinstall=False):
+
+def cmd_run(command, args, batch=None, results='-', jobs=None,
+            verbose_level=None, debug=None, reinstall=False):
     """Run command"""
     verbose_level = get_verbose_level(verbose_level)
     debug = get_debug(debug)
@@ -950,6 +2638,11 @@ def cmd_run(command, args, verbose_level=None, debug=None, reinstall=False):
     if config is None:
         return 1
 
+    if batch is not None:
+        if args:
+            raise BoxError("command arguments are not allowed in batch mode")
+        return run_batch(config, command, batch, results=results, jobs=jobs)
+
     executable = Path(config['venv_bin_dir']) / command
     if not executable.is_file():
         LOG.error("missing executable %s", executable)
@@ -1020,7 +2713,7 @@ Box {box_name!r} - configure box script
     parser.set_defaults(
         function=cmd_configure,
         function_args=['install_dir', 'output_path', 'wrap_info', 'verbose_level', 'debug',
-                       'freeze', 'update_shebang'],
+                       'freeze', 'update_shebang', 'cache_runtime', 'zygote'],
     )
     add_common_arguments(parser)
 
@@ -1036,6 +2729,34 @@ Box {box_name!r} - configure box script
         action="store_false",
         help="do not update shebang")
 
+    cache_runtime_group = parser.add_argument_group("runtime cache")
+    cache_runtime_mgrp = cache_runtime_group.add_mutually_exclusive_group()
+    cache_runtime_kwargs = {'dest': 'cache_runtime', 'default': UNDEFINED}
+    cache_runtime_mgrp.add_argument(
+        "-c", "--cache-runtime",
+        action="store_true",
+        help="cache the compiled box runtime at install",
+        **cache_runtime_kwargs)
+    cache_runtime_mgrp.add_argument(
+        "-C", "--no-cache-runtime",
+        action="store_false",
+        help="do not cache the compiled box runtime",
+        **cache_runtime_kwargs)
+
+    zygote_group = parser.add_argument_group("zygote")
+    zygote_mgrp = zygote_group.add_mutually_exclusive_group()
+    zygote_kwargs = {'dest': 'zygote', 'default': UNDEFINED}
+    zygote_mgrp.add_argument(
+        "-z", "--zygote",
+        action="store_true",
+        help="run wrapped commands through the zygote server",
+        **zygote_kwargs)
+    zygote_mgrp.add_argument(
+        "-Z", "--no-zygote",
+        action="store_false",
+        help="do not use the zygote server",
+        **zygote_kwargs)
+
     install_dir_group = parser.add_argument_group("install_dir")
     install_dir_mgrp = install_dir_group.add_mutually_exclusive_group()
     install_dir_kwargs = {'dest': 'install_dir', 'default': UNDEFINED}
@@ -1113,6 +2834,11 @@ Box {box_name!r} - list available commands
         action="store_const", const="packages",
         help="list packages",
         **what_kwargs)
+    what_mgrp.add_argument(
+        "-a", "--assets",
+        action="store_const", const="assets",
+        help="list assets and their extracted paths",
+        **what_kwargs)
     # what_mgrp.add_argument(
     #     "-b", "--boxes",
     #     action="store_const", const="boxes",
@@ -1121,6 +2847,30 @@ Box {box_name!r} - list available commands
     return parser
 
 
+def add_link_parser(subparsers):
+    parser = subparsers.add_parser(
+        "link",
+        description="""\
+Box {box_name!r} - create a link to the box for each wrapped command;
+running a link runs the command with the same name
+""".format(**STATE))
+    parser.set_defaults(
+        function=cmd_link,
+        function_args=['directory', 'force', 'verbose_level', 'debug'],
+    )
+    add_common_arguments(parser)
+    parser.add_argument(
+        "-l", "--link-dir",
+        dest="directory", metavar="DIR",
+        type=Path, default=None,
+        help="create the links in DIR (default: the box directory)")
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true", default=False,
+        help="replace existing files")
+    return parser
+
+
 def add_run_parser(subparsers):
     parser = subparsers.add_parser(
         "run",
@@ -1129,10 +2879,26 @@ Box {box_name!r} - run installed command
 """.format(**STATE))
     parser.set_defaults(
         function=cmd_run,
-        function_args=['command', 'args', 'verbose_level', 'debug', 'reinstall'],
+        function_args=['command', 'args', 'batch', 'results', 'jobs',
+                       'verbose_level', 'debug', 'reinstall'],
     )
     add_common_arguments(parser)
     add_reinstall_argument(parser)
+    batch_group = parser.add_argument_group("batch")
+    batch_group.add_argument(
+        "-b", "--batch",
+        metavar="FILE", default=None,
+        help="run the command entry point once for each line of FILE ('-' for stdin); "
+             "each line is a json array or a shell-quoted list of arguments")
+    batch_group.add_argument(
+        "-o", "--results",
+        metavar="FILE", default="-",
+        help="write the batch results (one json line per item) to FILE (default: stdout; "
+             "the output of the items then goes to stderr)")
+    batch_group.add_argument(
+        "-j", "--jobs",
+        type=int, default=None,
+        help="run the batch items with a pool of JOBS workers")
     parser.add_argument(
         "command",
         help="command name")
@@ -1143,6 +2909,28 @@ Box {box_name!r} - run installed command
     return parser
 
 
+def add_zygote_parser(subparsers):
+    parser = subparsers.add_parser(
+        "zygote",
+        description="""\
+Box {box_name!r} - run the zygote server for the wrapped commands
+""".format(**STATE))
+    parser.set_defaults(
+        function=cmd_zygote,
+        function_args=['stop', 'idle_timeout'],
+    )
+    add_common_arguments(parser)
+    parser.add_argument(
+        "-k", "--stop",
+        action="store_true", default=False,
+        help="stop the running zygote server")
+    parser.add_argument(
+        "-T", "--idle-timeout",
+        type=float, default=None,
+        help="exit after this number of idle seconds (default: {})".format(ZYGOTE_IDLE_TIMEOUT))
+    return parser
+
+
 def add_extract_parser(subparsers):
     def archive_hash(value):
         matching_entries = []
@@ -1186,6 +2974,24 @@ Box {box_name!r} - extract archives
     return parser
 
 
+def add_verify_parser(subparsers):
+    parser = subparsers.add_parser(
+        "verify",
+        description="""\
+Box {box_name!r} - verify the archives hashes
+""".format(**STATE))
+    parser.set_defaults(
+        function=cmd_verify,
+        function_args=['jobs', 'verbose_level', 'debug'],
+    )
+    add_common_arguments(parser)
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int, default=None,
+        help="verify the archives with a pool of JOBS threads (default: cpu count)")
+    return parser
+
+
 def add_install_parser(subparsers):
     parser = subparsers.add_parser(
         "install",
@@ -1312,10 +3118,13 @@ Box {box_name} - manage box
     add_show_parser(subparsers)
     add_configure_parser(subparsers)
     add_extract_parser(subparsers)
+    add_verify_parser(subparsers)
     add_install_parser(subparsers)
     add_uninstall_parser(subparsers)
     add_list_parser(subparsers)
+    add_link_parser(subparsers)
     add_run_parser(subparsers)
+    add_zygote_parser(subparsers)
 
     namespace = parser.parse_args(args)
     verbose_level = getattr(namespace, 'verbose_level', None)
@@ -1348,7 +3157,12 @@ def main_wrap_multiple(commands, args):
     if config is None:
         return 1
     if commands is None:
-        commands = {name: name for name in config["installed_commands"]}
+        index = get_command_index(config)
+        commands = {name: name for name, command_info in index['commands'].items()
+                    if command_info['installed']}
+    link_name = get_link_name()
+    if link_name in commands:
+        return _wrap_command(config, commands[link_name], args)
     c_args, a_args = args[:1], args[1:]
     parser = argparse.ArgumentParser(description=STATE['box_name'])
     parser.add_argument(
@@ -1361,7 +3175,7 @@ def main_wrap_multiple(commands, args):
 
 
 def _wrap_command(config, command, args):
-    installed_commands = find_executables(config['venv_bin_dir'])
+    installed_commands = get_command_index(config)['commands']
 
     if command not in installed_commands:
         LOG.error("missing command %s", command)
@@ -1389,14 +3203,14 @@ def _wrap_command(config, command, args):
 """.format(prog=sys.argv[0]))
         sys.exit(1)
 
-    executable = str(Path(config['venv_bin_dir']) / command)
-    cmdline = [executable] + list(args)
+    command_info = installed_commands[command]
     environ = get_environ(config)
-    return os.execve(executable, cmdline, environ)
+    return _run_command(config['install_dir'], command_info['path'], command_info['entry_point'],
+                        args, environ, zygote=ZYGOTE, in_process=IN_PROCESS)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 # --- end-of-source ---
 # --- archives ---
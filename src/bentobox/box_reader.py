@@ -0,0 +1,88 @@
+"""
+Read box headers without running the boxes
+"""
+
+from pathlib import Path
+
+from . import box_file
+
+
+__all__ = [
+    'BoxReadError',
+    'BoxReader',
+    'read_box_header',
+]
+
+
+MAX_HEADER_LEN = 16 * 1024 ** 2
+READ_BLOCK_SIZE = 65536
+
+
+class BoxReadError(ValueError):
+    pass
+
+
+def read_box_header(box_path, max_header_len=MAX_HEADER_LEN):
+    """Read the shebang and the state of a box
+
+    At most max_header_len bytes (plus a read block) are read from the box.
+    """
+    mark = ("\n" + box_file.MARK_END_OF_HEADER + "\n").encode('utf-8')
+    with open(box_path, "rb") as box:
+        data = box.read(READ_BLOCK_SIZE)
+        lines = data.split(b"\n", 2)
+        header_size = box_file.parse_header_size(lines[1]) if len(lines) > 2 else None
+        if header_size is not None:
+            if header_size > max_header_len:
+                raise BoxReadError("{}: header too long".format(box_path))
+            data += box.read(max(0, header_size - len(data)))
+            header = data[:header_size]
+        else:
+            # boxes created without a header slot
+            while mark not in data:
+                if len(data) > max_header_len:
+                    raise BoxReadError("{}: header too long".format(box_path))
+                chunk = box.read(READ_BLOCK_SIZE)
+                if not chunk:
+                    raise BoxReadError("{}: not a box file".format(box_path))
+                data += chunk
+            header = data[:data.index(mark) + 1]
+    if not header.startswith(b"#!"):
+        raise BoxReadError("{}: not a box file".format(box_path))
+    shebang = str(header[2:header.index(b"\n")], 'utf-8').strip()
+    begin = header.find(b'\n"""\n')
+    end = header.find(b'\n"""\n', begin + 5)
+    if begin < 0 or end < 0:
+        raise BoxReadError("{}: missing box state".format(box_path))
+    try:
+        state = box_file.load_state(str(header[begin + 5:end], 'utf-8'))
+    except (ValueError, KeyError) as err:
+        raise BoxReadError("{}: invalid box state: {}".format(box_path, err)) from None
+    return shebang, state
+
+
+class BoxReader:
+    """Read a box state from its header, without running the box"""
+    def __init__(self, box_path, max_header_len=MAX_HEADER_LEN):
+        self.box_path = Path(box_path)
+        self.shebang, self.state = read_box_header(self.box_path, max_header_len=max_header_len)
+
+    @property
+    def box_name(self):
+        return self.state['box_name']
+
+    @property
+    def packages(self):
+        return self.state['packages']
+
+    def get_archives(self):
+        """Return [(archive_hash, archive_name, size)...]
+
+        size is the archive size, or None for boxes created without it.
+        """
+        return [(pkg['hash'], pkg['name'], pkg.get('size', None))
+                for pkg in self.packages if pkg['type'] == 'archive']
+
+    def show(self, mode='text'):
+        """Print the box state"""
+        box_file.show(mode=mode, state=self.state)
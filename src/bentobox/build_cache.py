@@ -0,0 +1,151 @@
+"""
+Build cache of the local project archives
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+from .env import get_bentobox_version
+
+
+__all__ = [
+    'BUILD_CACHE_MODES',
+    'get_project_fingerprint',
+    'lookup',
+    'store',
+    'evict',
+]
+
+
+BUILD_CACHE_MODES = ('stat', 'content', 'none')
+
+# build products and vcs metadata at the top of the project dir do not
+# change the source distribution (a nested 'build' dir may be a package);
+# egg-info dirs are rewritten by every sdist run, at any depth
+IGNORED_TOP_DIRS = {'.git', '.hg', '.svn', '.tox', '.nox', '.eggs', '__pycache__',
+                    'build', 'dist'}
+IGNORED_DIR_SUFFIXES = ('.egg-info',)
+
+ENTRY_FILE = "bentobox-build.json"
+READ_BLOCK_SIZE = 1024 ** 2
+
+
+def _iter_project_files(project_dir):
+    for dirpath, dirnames, filenames in os.walk(project_dir):
+        ignored_dirs = IGNORED_TOP_DIRS if dirpath == str(project_dir) else ()
+        dirnames[:] = sorted(dirname for dirname in dirnames
+                             if dirname not in ignored_dirs and
+                             not dirname.endswith(IGNORED_DIR_SUFFIXES))
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename)
+
+
+def get_project_fingerprint(project_dir, mode='stat', kind='sdist'):
+    """Make the fingerprint of a project source tree
+
+    The fingerprint covers the relative paths, sizes and mtimes of the
+    files ('stat' mode) or their content hashes ('content' mode), the kind
+    of archive built ('sdist' or 'wheel'), and the python and bentobox
+    versions.
+    """
+    entries = []
+    for path in _iter_project_files(project_dir):
+        path_stat = os.stat(path)
+        entry = [os.path.relpath(path, project_dir), path_stat.st_size]
+        if mode == 'content':
+            hashobj = hashlib.sha256()
+            with open(path, "rb") as source_file:
+                for data in iter(lambda: source_file.read(READ_BLOCK_SIZE), b''):
+                    hashobj.update(data)
+            entry.append(hashobj.hexdigest())
+        else:
+            entry.append(path_stat.st_mtime_ns)
+        entries.append(entry)
+    data = {
+        'bentobox_version': get_bentobox_version(),
+        'python_version': sys.version,
+        'mode': mode,
+        'kind': kind,
+        'files': entries,
+    }
+    return hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(source_path, target_path):
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+def lookup(cache_dir, key, dist_dir):
+    """Get the cached archives of key into dist_dir; returns None if they are not cached
+
+    The archives are hard-linked (or copied), so that they survive an
+    eviction. A cache hit marks the entry as recently used.
+    """
+    entry_dir = Path(cache_dir) / key
+    try:
+        with open(entry_dir / ENTRY_FILE, "r") as entry_file:
+            archive_names = json.load(entry_file)['archives']
+        archive_paths = []
+        for archive_name in archive_names:
+            archive_path = Path(dist_dir) / archive_name
+            _link_or_copy(entry_dir / archive_name, archive_path)
+            archive_paths.append(archive_path)
+        os.utime(entry_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+    return archive_paths
+
+
+def store(cache_dir, key, archive_paths, max_size):
+    """Store the archives of key in the cache, then evict the least recently used entries"""
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        cache_dir.mkdir(parents=True)
+    tmp_entry_dir = cache_dir / ".tmp-{}".format(uuid.uuid4().hex)
+    tmp_entry_dir.mkdir()
+    try:
+        for archive_path in archive_paths:
+            _link_or_copy(archive_path, tmp_entry_dir / archive_path.name)
+        with open(tmp_entry_dir / ENTRY_FILE, "w") as entry_file:
+            json.dump({'archives': [archive_path.name for archive_path in archive_paths]},
+                      entry_file)
+        # the entry appears atomically; a concurrent build may have stored it first
+        tmp_entry_dir.rename(cache_dir / key)
+    except OSError:
+        pass
+    finally:
+        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+    evict(cache_dir, max_size)
+
+
+def _get_entry_size(entry_dir):
+    size = 0
+    for path in entry_dir.iterdir():
+        size += path.stat().st_size
+    return size
+
+
+def evict(cache_dir, max_size):
+    """Remove the least recently used entries until the cache size is at most max_size"""
+    entries = []
+    for entry_dir in Path(cache_dir).iterdir():
+        if entry_dir.name.startswith('.'):
+            continue
+        try:
+            entries.append((entry_dir.stat().st_mtime_ns, _get_entry_size(entry_dir), entry_dir))
+        except OSError:
+            continue
+    total_size = sum(entry[1] for entry in entries)
+    for _, entry_size, entry_dir in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= entry_size
@@ -8,12 +8,18 @@ import sys
 import traceback
 from pathlib import Path
 
-from .create_box_file import create_box_file
+from .create_box_file import (
+    create_box_file,
+    BUILD_CACHE_MODES,
+    CODECS,
+    DEFAULT_HASH_ALGORITHM,
+    HASH_ALGORITHMS,
+)
 from .env import (
     DEFAULT_PYTHON_INTERPRETER,
     get_bentobox_version,
 )
-from .util import load_box_module
+from .box_reader import BoxReader
 from .box_file import (
     wrap_single,
     wrap_multiple,
@@ -36,23 +42,50 @@ def t_python_exe(value):
     return value
 
 
+def t_codec(value):
+    pattern, sep, codec = value.rpartition('=')
+    if codec not in CODECS or (sep and codec == 'auto'):
+        raise ValueError(value)
+    if sep:
+        return (pattern, codec)
+    return (None, codec)
+
+
+def t_asset(value):
+    name, sep, path = value.partition('=')
+    if not sep or not path:
+        raise ValueError(value)
+    return (name, Path(path))
+
+
 def function_create(box_name, wrap_info, output_path,
                     packages, pip_install_args, update_shebang, check,
-                    python_interpreter, force_overwrite, freeze,
-                    verbose_level, debug):
+                    python_interpreter, force_overwrite, freeze, cache_runtime,
+                    zygote, binary, codecs, assets, hash_algorithm, jobs,
+                    build_cache, wheels, bundle_deps, find_links, verbose_level, debug):
     # pylint: disable=too-many-arguments
+    codec = 'auto'
+    archive_codecs = []
+    for pattern, pattern_codec in codecs or ():
+        if pattern is None:
+            codec = pattern_codec
+        else:
+            archive_codecs.append((pattern, pattern_codec))
     create_box_file(box_name, output_path=output_path, wrap_info=wrap_info,
                     pip_install_args=pip_install_args,
                     packages=packages, update_shebang=update_shebang,
                     check=check, python_interpreter=python_interpreter,
                     force_overwrite=force_overwrite, freeze=freeze,
+                    cache_runtime=cache_runtime, zygote=zygote, binary=binary,
+                    codec=codec, archive_codecs=archive_codecs, assets=assets or (),
+                    hash_algorithm=hash_algorithm, jobs=jobs, build_cache=build_cache,
+                    wheels=wheels, bundle_deps=bundle_deps, find_links=find_links or (),
                     verbose_level=verbose_level,
                     debug=debug)
 
 
 def function_show(box_path, mode="text"):
-    box_module = load_box_module(box_path)
-    box_module.show(mode=mode)  # pylint: disable=no-member
+    BoxReader(box_path).show(mode=mode)
 
 
 def add_create_parser(subparsers):
@@ -66,6 +99,9 @@ Create a box file
         function_args=['box_name', 'wrap_info', 'output_path', 'freeze',
                        'packages', 'pip_install_args', 'update_shebang',
                        'check', 'python_interpreter', 'force_overwrite',
+                       'cache_runtime', 'zygote', 'binary', 'codecs', 'assets',
+                       'hash_algorithm', 'jobs', 'build_cache', 'wheels',
+                       'bundle_deps', 'find_links',
                        'verbose_level', 'debug'],
     )
     default_verbose_level = 0
@@ -185,11 +221,90 @@ Create a box file
         action="store_false",
         help="do not freeze virtualenv")
 
+    box_group.add_argument(
+        "-R", "--cache-runtime",
+        dest="cache_runtime", default=False,
+        action="store_true",
+        help="cache the compiled box runtime at install")
+
+    box_group.add_argument(
+        "-Z", "--zygote",
+        dest="zygote", default=False,
+        action="store_true",
+        help="run wrapped commands through a pre-forking zygote server")
+
+    box_group.add_argument(
+        "-B", "--binary",
+        dest="binary", default=False,
+        action="store_true",
+        help="store the archives as a raw binary payload instead of base64 lines")
+
+    box_group.add_argument(
+        "-x", "--codec",
+        dest="codecs", metavar="[PATTERN=]CODEC",
+        action="append", type=t_codec, default=None,
+        help="compress the archives (or the archives matching PATTERN) with CODEC "
+             "({}); the default 'auto' compresses with zlib the archives "
+             "that are not already compressed".format(", ".join(CODECS)))
+
+    box_group.add_argument(
+        "-s", "--asset",
+        dest="assets", metavar="NAME=PATH",
+        action="append", type=t_asset, default=None,
+        help="store the file PATH in the box as the asset NAME; wrapped commands "
+             "get its extracted path in $BENTOBOX_ASSET_NAME")
+
+    box_group.add_argument(
+        "--wheels",
+        dest="wheels", default=False,
+        action="store_true",
+        help="build the project dirs and source archives into wheels, so that "
+             "nothing is compiled at install")
+
+    box_group.add_argument(
+        "--bundle-deps",
+        dest="bundle_deps", default=False,
+        action="store_true",
+        help="bundle the wheels of all the dependencies, so that the box installs "
+             "offline (implies --wheels)")
+
+    box_group.add_argument(
+        "--find-links",
+        dest="find_links", metavar="DIR",
+        action="append", type=Path, default=None,
+        help="with --bundle-deps, find the dependencies only in the wheelhouse "
+             "or index DIR")
+
+    box_group.add_argument(
+        "-H", "--hash-algorithm",
+        choices=HASH_ALGORITHMS, default=DEFAULT_HASH_ALGORITHM,
+        help="hash algorithm of the archives (default: {})".format(DEFAULT_HASH_ALGORITHM))
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int, default=None,
+        help="build the project dirs, and hash and encode the archives, "
+             "with a pool of JOBS workers (default: cpu count)")
+
+    build_cache_mgrp = parser.add_mutually_exclusive_group()
+    build_cache_kwargs = {'dest': 'build_cache', 'default': 'stat'}
+    build_cache_mgrp.add_argument(
+        "--build-cache",
+        choices=[mode for mode in BUILD_CACHE_MODES if mode != 'none'],
+        help="reuse the archives of the unchanged project dirs, comparing the "
+             "file stats (default) or the file contents",
+        **build_cache_kwargs)
+    build_cache_mgrp.add_argument(
+        "--no-build-cache",
+        action="store_const", const='none',
+        help="always build the project dirs",
+        **build_cache_kwargs)
+
     parser.add_argument(
         "-o", "--output-path",
         type=Path,
         default=None,
-        help="box path")
+        help="box path ('-' to write the box to stdout, without checking it)")
 
     parser.add_argument(
         "-n", "--box-name",
@@ -2,7 +2,13 @@
 Create a box file
 """
 
+import binascii
+import bz2
+import concurrent.futures
+import contextlib
+import fnmatch
 import hashlib
+import lzma
 import os
 import re
 import shlex
@@ -10,11 +16,21 @@ import subprocess
 import sys
 import tempfile
 import uuid
-from base64 import b64encode
+import zlib
 from pathlib import Path
 
 from .util import load_box_module
-from .env import DEFAULT_PYTHON_INTERPRETER
+from .env import (
+    DEFAULT_PYTHON_INTERPRETER,
+    get_build_cache_dir,
+    get_build_cache_size,
+)
+from .build_cache import (
+    BUILD_CACHE_MODES,
+    get_project_fingerprint,
+    lookup as build_cache_lookup,
+    store as build_cache_store,
+)
 from . import box_file
 
 
@@ -24,12 +40,21 @@ __all__ = [
     'BoxPathError',
     'BoxCommandError',
     'BoxFileError',
+    'BUILD_CACHE_MODES',
+    'CODECS',
+    'DEFAULT_HASH_ALGORITHM',
+    'HASH_ALGORITHMS',
+    'check_asset_name',
     'check_box_name',
+    'choose_codec',
     'create_box_file',
 ]
 
 
-Hash = hashlib.sha1
+DEFAULT_HASH_ALGORITHM = 'sha1'
+# fixed-length digests only: the hash is part of the archive entry lines
+HASH_ALGORITHMS = tuple(sorted(algorithm for algorithm in hashlib.algorithms_guaranteed
+                               if not algorithm.startswith('shake_')))
 
 
 class BoxCreateError(ValueError):
@@ -53,6 +78,19 @@ class BoxFileError(BoxCreateError):
 
 
 RE_BOX_NAME = re.compile(r"^\w+(?:\-\w+)*$")
+RE_ASSET_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+CODECS = ('auto', 'none', 'zlib', 'bz2', 'lzma')
+
+# magic numbers of gzip, bzip2, xz, zip (and wheel), zstd files
+COMPRESSED_MAGICS = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00', b'PK\x03\x04', b'\x28\xb5\x2f\xfd')
+
+SAMPLE_SIZE = 64 * 1024
+NUM_SAMPLES = 4
+MIN_COMPRESSION_RATIO = 0.9
+MIN_COMPRESSION_SIZE = 1024
+
+READ_BLOCK_SIZE = 1024 ** 2
 
 
 def check_box_name(value):
@@ -61,80 +99,398 @@ def check_box_name(value):
     return value
 
 
-def make_archives(tmpd, package_path):
-    if not package_path.exists():
-        raise BoxPathError("path {} does not exist".format(package_path))
-    if package_path.is_file():
-        yield package_path
-    elif package_path.is_dir():
-        setup_py_path = (package_path / "setup.py").resolve()
-        if not setup_py_path.is_file():
+def check_asset_name(value):
+    if not RE_ASSET_NAME.match(value):
+        raise BoxNameError(value)
+    return value
+
+
+def choose_codec(archive_path, codec='auto'):
+    """Choose the codec of an archive; returns None if it must be stored as it is
+
+    Already compressed archives, and archives that do not compress well on
+    a quick sample, are stored as they are.
+    """
+    if codec not in CODECS:
+        raise BoxCreateError("unknown codec {!r}".format(codec))
+    if codec == 'none':
+        return None
+    archive_size = archive_path.stat().st_size
+    if archive_size < MIN_COMPRESSION_SIZE:
+        return None
+    with open(archive_path, "rb") as archive_file:
+        if archive_file.read(8).startswith(COMPRESSED_MAGICS):
+            return None
+        sample_size = 0
+        compressed_size = 0
+        step = max(archive_size // NUM_SAMPLES, SAMPLE_SIZE)
+        for offset in range(0, archive_size, step):
+            archive_file.seek(offset)
+            data = archive_file.read(SAMPLE_SIZE)
+            sample_size += len(data)
+            compressed_size += len(zlib.compress(data, 1))
+    if sample_size and compressed_size > sample_size * MIN_COMPRESSION_RATIO:
+        return None
+    if codec == 'auto':
+        return 'zlib'
+    return codec
+
+
+def make_compressor(codec):
+    """Make a compressor object for codec"""
+    if codec == 'zlib':
+        return zlib.compressobj(9)
+    if codec == 'bz2':
+        return bz2.BZ2Compressor(9)
+    if codec == 'lzma':
+        return lzma.LZMACompressor()
+    raise BoxCreateError("unknown codec {!r}".format(codec))
+
+
+def iter_archive_data(archive_path, codec, hashobj):
+    """Iterate over the (possibly compressed) archive data, hashing the original data"""
+    compressor = None
+    if codec is not None:
+        compressor = make_compressor(codec)
+    with open(archive_path, "rb") as archive_file:
+        while True:
+            data = archive_file.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            hashobj.update(data)
+            if compressor is not None:
+                data = compressor.compress(data)
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def iter_line_blocks(blocks, line_len):
+    """Split a stream of blocks in blocks of whole lines of line_len bytes
+
+    Only the last line of the last block may be shorter.
+    """
+    buffer = b''
+    for data in blocks:
+        buffer += data
+        end = len(buffer) - len(buffer) % line_len
+        if end:
+            yield buffer[:end]
+            buffer = buffer[end:]
+    if buffer:
+        yield buffer
+
+
+def encode_lines(data, line_len=70):
+    """Encode a block of lines as base64 comment lines"""
+    view = memoryview(data)
+    lines = [binascii.b2a_base64(view[pos:pos + line_len])
+             for pos in range(0, len(data), line_len)]
+    return b"#" + b"#".join(lines)
+
+
+def iter_encoded(blocks, binary):
+    """Encode the archive data for the archives section of the box"""
+    if binary:
+        return blocks
+    return map(encode_lines, iter_line_blocks(blocks, 70))
+
+
+def encode_archive(archive_path, codec, binary, hash_algorithm, spool_path=None):
+    """Hash and encode an archive, writing the encoded data to spool_path (if any)
+
+    Returns (archive_hash, archive_length), archive_length being the length
+    of the encoded data.
+    """
+    hashobj = hashlib.new(hash_algorithm)
+    archive_length = 0
+    with contextlib.ExitStack() as stack:
+        spool_file = None
+        if spool_path is not None:
+            spool_file = stack.enter_context(open(spool_path, "wb"))
+        for data in iter_encoded(iter_archive_data(archive_path, codec, hashobj), binary):
+            archive_length += len(data)
+            if spool_file is not None:
+                spool_file.write(data)
+    return hashobj.hexdigest(), archive_length
+
+
+def map_jobs(function, jobs, max_workers=None):
+    """Run function(*job) for each job, in a process pool if there is more than one"""
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if len(jobs) > 1 and max_workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(len(jobs), max_workers)) as executor:
+            return list(executor.map(function, *zip(*jobs)))
+    return [function(*job) for job in jobs]
+
+
+def make_archive_entry(archive_name, archive_hash, archive_length, binary):
+    """Make the lines preceding the archive data in the archives section"""
+    entry = "#\n#{}\n#{}\n".format(archive_name, archive_hash)
+    if binary:
+        entry += "#{:020d}\n".format(archive_length)
+    return entry.encode('utf-8')
+
+
+def set_archive_info(package_info, archive_path, archive_hash, archive_offset, archive_length,
+                     archive_codec):
+    """Record the archive hash and position in the package data"""
+    package_info.update({
+        'hash': archive_hash,
+        'offset': archive_offset,
+        'length': archive_length,
+        'size': archive_path.stat().st_size,
+    })
+    if archive_codec is not None:
+        package_info['codec'] = archive_codec
+
+
+def get_archive_codec(archive_name, archive_codecs):
+    """Get the codec forced for an archive name, if any"""
+    for pattern, archive_codec in archive_codecs:
+        if fnmatch.fnmatch(archive_name, pattern):
+            return archive_codec
+    return None
+
+
+def is_local_package(package):
+    """Local packages (archives or project dirs) are paths, not pypi names"""
+    return bool({'/', '.'}.intersection(str(package)))
+
+
+def run_build_command(cmdline, cwd):
+    """Run a build command; returns its output"""
+    result = subprocess.run(cmdline, cwd=str(cwd), stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, check=False)
+    output = str(result.stdout, 'utf-8', 'replace')
+    if result.returncode:
+        clist = [cmdline[0]] + [shlex.quote(arg) for arg in cmdline[1:]]
+        cmd = " ".join(clist)
+        raise BoxCommandError("command {} failed (in {}):\n{}".format(cmd, cwd, output))
+    return output
+
+
+def build_sdist(project_dir, dist_dir):
+    """Build the source distribution of a project dir; returns (archive paths, output)"""
+    setup_py_path = project_dir / "setup.py"
+    output = run_build_command(
+        [sys.executable, str(setup_py_path), "sdist", "--dist-dir", str(dist_dir)],
+        cwd=project_dir)
+    return sorted(dist_dir.glob("*")), output
+
+
+def build_wheel(package_path, dist_dir):
+    """Build the wheel of a project dir or source archive; returns (archive paths, output)"""
+    cwd = package_path if package_path.is_dir() else package_path.parent
+    output = run_build_command(
+        [sys.executable, "-m", "pip", "wheel", "--no-deps", "--wheel-dir", str(dist_dir),
+         str(package_path)],
+        cwd=cwd)
+    return sorted(dist_dir.glob("*.whl")), output
+
+
+def build_dependencies(requirements, dist_dir, find_links=()):
+    """Build the wheels of the dependency closure of requirements; returns (wheel paths, output)
+
+    If find_links is set, the dependencies are found only in these dirs
+    (local wheelhouses or index dirs), otherwise in the package index.
+    """
+    cmdline = [sys.executable, "-m", "pip", "wheel", "--wheel-dir", str(dist_dir)]
+    if find_links:
+        cmdline.append("--no-index")
+        for link in find_links:
+            cmdline.extend(["--find-links", str(Path(link).resolve())])
+    cmdline.extend(str(requirement) for requirement in requirements)
+    output = run_build_command(cmdline, cwd=dist_dir)
+    return sorted(dist_dir.glob("*.whl")), output
+
+
+def build_project(project_dir, dist_dir, build_cache='stat', wheels=False):
+    """Build a project dir, or get its archives from the build cache
+
+    build_cache is the fingerprint mode of the project tree ('stat' or
+    'content'), or 'none' to always build. Returns (archive paths, output);
+    the output is None if the archives come from the build cache.
+    """
+    build = build_wheel if wheels else build_sdist
+    if build_cache == 'none':
+        return build(project_dir, dist_dir)
+    cache_dir = get_build_cache_dir()
+    key = get_project_fingerprint(project_dir, mode=build_cache,
+                                  kind='wheel' if wheels else 'sdist')
+    archive_paths = build_cache_lookup(cache_dir, key, dist_dir)
+    if archive_paths is not None:
+        return archive_paths, None
+    archive_paths, output = build(project_dir, dist_dir)
+    build_cache_store(cache_dir, key, archive_paths, get_build_cache_size())
+    return archive_paths, output
+
+
+def needs_build(package_path, wheels=False):
+    """Project dirs are always built; source archives are built only into wheels"""
+    if package_path.is_dir():
+        return True
+    return wheels and package_path.suffix != ".whl"
+
+
+def make_archives(tmpd, package_paths, jobs=None, build_cache='stat', wheels=False):
+    """Make the archives of local packages
+
+    Returns a list of (absolute archive paths, build output), in order;
+    the output is None for the packages that are not built. Archive files
+    are taken as they are; project dirs are built by a pool of jobs threads
+    (default: cpu count), each build in its own dir, with its own output.
+    The archives of unchanged project dirs are reused from the build cache,
+    so that they keep the same content and hash.
+    If wheels is set, project dirs and source archives are built into wheels.
+    """
+    builds = {}
+    for package_path in package_paths:
+        if not package_path.exists():
             raise BoxPathError("path {} does not exist".format(package_path))
-        tmpdir = Path(tmpd).joinpath(uuid.uuid4().hex)
-        tmpdir.mkdir()
-        old_cwd = Path.cwd()
-        try:
-            os.chdir(setup_py_path.parent)
-            cmdline = [sys.executable, str(setup_py_path), "sdist", "--dist-dir", str(tmpdir)]
-            result = subprocess.run(cmdline, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                    check=False)
-            clist = [cmdline[0]] + [shlex.quote(arg) for arg in cmdline[1:]]
-            cmd = " ".join(clist)
-            if result.returncode:
-                raise BoxCommandError("command {} failed".format(cmd))
-        finally:
-            os.chdir(old_cwd)
-        for archive_path in tmpdir.glob("*"):
-            yield archive_path
+        if package_path.is_dir():
+            project_dir = package_path.resolve()
+            if not wheels and not (project_dir / "setup.py").is_file():
+                raise BoxPathError("path {} does not exist".format(project_dir / "setup.py"))
+        if needs_build(package_path, wheels):
+            builds[package_path.resolve()] = None
+    if builds:
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, min(len(builds), jobs))) as executor:
+            for build_path in builds:
+                dist_dir = Path(tmpd).joinpath(uuid.uuid4().hex)
+                dist_dir.mkdir()
+                if build_path.is_dir():
+                    builds[build_path] = executor.submit(
+                        build_project, build_path, dist_dir, build_cache, wheels)
+                else:
+                    builds[build_path] = executor.submit(build_wheel, build_path, dist_dir)
+            for build_path, future in builds.items():
+                builds[build_path] = future.result()
+    archive_lists = []
+    for package_path in package_paths:
+        if needs_build(package_path, wheels):
+            archive_lists.append(builds[package_path.resolve()])
+        else:
+            archive_lists.append(([package_path.resolve()], None))
+    return archive_lists
 
 
 def create_box_file(box_name, output_path=None, mode=0o555, wrap_info=None,
                     packages=(), pip_install_args=None,
-                    update_shebang=True, check=True, freeze=True,
+                    update_shebang=True, check=True, freeze=True, cache_runtime=False,
+                    zygote=False, binary=False, codec='auto', archive_codecs=(), assets=(),
+                    hash_algorithm=DEFAULT_HASH_ALGORITHM, jobs=None, build_cache='stat',
+                    wheels=False, bundle_deps=False, find_links=(),
                     python_interpreter=DEFAULT_PYTHON_INTERPRETER,
                     force_overwrite=False, verbose_level=1, debug=False):
+    """Create a box file
+
+    codec is the default codec of the archives ('auto' compresses only
+    the archives that compress well); archive_codecs is a list of
+    (pattern, codec) forcing the codec of the archives matching pattern.
+    assets is a list of (name, path) of data files stored in the box as
+    they are (never compressed), and extracted at install.
+    Local project dirs are built by a pool of jobs threads; the archives are
+    hashed with hash_algorithm, and hashed and encoded by a pool of jobs
+    processes (default: cpu count).
+    build_cache is the build cache mode of the local project dirs ('stat',
+    'content' or 'none'). If wheels is set, local project dirs and source
+    archives are built into wheels, whose tags are checked at install.
+    If bundle_deps is set, the wheels of the dependency closure of all the
+    packages (found in the find_links dirs, if any) are bundled too, and the
+    box installs offline; it implies wheels.
+    If output_path is '-' the box is written to stdout, without seeking
+    (the archives are read twice, and the box is not checked).
+    """
     # pylint: disable=too-many-arguments
     if wrap_info is None:
         wrap_info = box_file.WrapInfo(box_file.WrapMode.NONE, None)
     box_name = check_box_name(box_name)
+    # '-' streams the box to stdout, strictly sequentially
+    stream = str(output_path) == '-'
     if output_path is None:
         output_path = Path(box_name).resolve()
-    else:
+    elif not stream:
         output_path = Path(output_path).resolve()
-    if output_path.exists():
+    if not stream and output_path.exists():
         if force_overwrite:
             output_path.unlink()
         else:
             raise BoxFileError("file {!r} already exists".format(str(output_path)))
 
-    with tempfile.TemporaryDirectory() as tmpd:
+    if bundle_deps:
+        wheels = True
+
+    with tempfile.TemporaryDirectory() as tmpd, \
+            box_file.Printer(verbose_level=verbose_level, debug=debug) as printer:
         if pip_install_args is None:
             pip_install_args = []
 
         template = box_file.__file__
 
-        if not output_path.parent.exists():
+        if not stream and not output_path.parent.exists():
             output_path.parent.mkdir(parents=True)
 
-        hash_placeholder = Hash().hexdigest()
+        if hash_algorithm not in HASH_ALGORITHMS:
+            raise BoxCreateError("unknown hash algorithm {!r}".format(hash_algorithm))
+        hash_placeholder = hashlib.new(hash_algorithm).hexdigest()
         packages_data = []
         archives = []
+        local_archives = iter(make_archives(
+            tmpd, [Path(package) for package in packages if is_local_package(package)],
+            jobs=jobs, build_cache=build_cache, wheels=wheels))
         for package in packages:
-            if {'/', '.'}.intersection(str(package)):
-                for archive_path in make_archives(tmpd, Path(package)):
+            if is_local_package(package):
+                archive_paths, build_output = next(local_archives)
+                if build_output is not None:
+                    printer("built {}:\n{}".format(package, build_output.rstrip('\n')),
+                            debug=True)
+                elif Path(package).is_dir():
+                    printer("reused the cached build of {}".format(package), debug=True)
+                for archive_path in archive_paths:
                     archive_name = archive_path.name
                     archive_index = len(packages_data)
-                    packages_data.append({
+                    package_data = {
                         'type': 'archive',
                         'name': archive_name,
                         'hash': hash_placeholder,
-                    })
+                    }
+                    if archive_path.suffix == ".whl":
+                        package_data['wheel_tags'] = box_file.get_wheel_tags(archive_name)
+                    packages_data.append(package_data)
                     archives.append((archive_index, archive_path))
             else:
                 packages_data.append({
                     'type': 'package',
                     'name': package,
                 })
+        if bundle_deps:
+            # the dependencies are bundled, but not installed explicitly:
+            # pip finds them among the extracted archives
+            deps_dir = Path(tmpd).joinpath(uuid.uuid4().hex)
+            deps_dir.mkdir()
+            requirements = [archive_path for _, archive_path in archives]
+            requirements += [package_data['name'] for package_data in packages_data
+                             if package_data['type'] == 'package']
+            archive_names = {package_data['name'] for package_data in packages_data}
+            deps_paths, build_output = build_dependencies(requirements, deps_dir, find_links)
+            printer("built the dependencies:\n{}".format(build_output.rstrip('\n')), debug=True)
+            for archive_path in deps_paths:
+                if archive_path.name in archive_names:
+                    continue
+                archives.append((len(packages_data), archive_path))
+                packages_data.append({
+                    'type': 'archive',
+                    'name': archive_path.name,
+                    'hash': hash_placeholder,
+                    'wheel_tags': box_file.get_wheel_tags(archive_path.name),
+                    'dependency': True,
+                })
 
         state = {
             "box_name": box_name,
@@ -144,54 +500,103 @@ def create_box_file(box_name, output_path=None, mode=0o555, wrap_info=None,
             "wraps": wrap_info.wraps,
             "freeze": freeze,
             "update_shebang": update_shebang,
+            "cache_runtime": bool(cache_runtime),
+            "zygote": bool(zygote),
+            "box_format": "binary" if binary else "text",
+            "hash_algorithm": hash_algorithm,
             "verbose_level": int(verbose_level),
             "debug": bool(debug),
             "pip_install_args": pip_install_args,
             "packages": packages_data,
         }
+        if bundle_deps:
+            state['bundle_deps'] = True
 
-        with open(output_path, "w+") as f_out, open(template, "r") as f_in:
-            f_out.write(box_file.create_header(state, fill_len=box_file.HEADER_FILL_LEN))
-            status = 'skip'
-            for line in f_in:
-                if status == 'skip':
-                    if line.startswith(box_file.MARK_END_OF_HEADER):
-                        f_out.write(line)
-                        status = 'copy'
-                elif status == 'copy':
-                    f_out.write(line)
-                    if line.startswith(box_file.MARK_END_OF_SOURCE):
-                        break
-            f_out.write(box_file.MARK_ARCHIVES + '\n')
-            hash_pos_list = []
-            for archive_index, archive_path in archives:
-                package_info = packages_data[archive_index]
-                archive_name = package_info['name']
-                f_out.write("#\n")
-                f_out.write("#{}\n".format(archive_name))
-                archive_hash_pos = f_out.tell()
-                f_out.write("#{}\n".format(hash_placeholder))
-                hashobj = Hash()
-                with open(archive_path, "rb") as archive_file:
-                    bsize = 70
-                    while True:
-                        data = archive_file.read(bsize)
-                        if not data:
-                            break
-                        hashobj.update(data)
-                        encoded_data = str(b64encode(data), 'utf-8')
-                        f_out.write("#" + encoded_data + "\n")
-                    f_out.flush()
-                archive_hash = hashobj.hexdigest()
-                packages_data[archive_index]['hash'] = archive_hash
-                hash_pos_list.append((archive_hash_pos, archive_hash))
-            # replace hash
-            for pos, archive_hash in hash_pos_list:
-                f_out.seek(pos)
-                f_out.write("#{}".format(archive_hash))
-
+        runtime_source = box_file.get_runtime_source(template)[1]
+        state['runtime_hash'] = box_file.make_runtime_hash(runtime_source)
+        if binary:
+            section_mark = box_file.MARK_PAYLOAD + '\n'
+        else:
+            section_mark = box_file.MARK_ARCHIVES + '\n'
+        archive_jobs = []
+        for archive_index, archive_path in archives:
+            archive_name = packages_data[archive_index]['name']
+            archive_codec = get_archive_codec(archive_name, archive_codecs)
+            if archive_codec is None or archive_codec == 'auto':
+                archive_codec = choose_codec(archive_path, archive_codec or codec)
+            elif archive_codec == 'none':
+                archive_codec = None
+            archive_jobs.append((packages_data[archive_index], archive_path, archive_codec))
+        asset_names = set()
+        for asset_name, asset_path in assets:
+            check_asset_name(asset_name)
+            if asset_name in asset_names:
+                raise BoxNameError("duplicate asset {}".format(asset_name))
+            asset_names.add(asset_name)
+            asset_path = Path(asset_path)
+            if not asset_path.is_file():
+                raise BoxPathError("asset path {} does not exist".format(asset_path))
+            asset_info = {'name': asset_name, 'hash': hash_placeholder}
+            state.setdefault('assets', []).append(asset_info)
+            archive_jobs.append((asset_info, asset_path, None))
+
+        # first pass, in parallel: hash and encode the archives, so that the
+        # complete state is known before writing the box; the encoded data
+        # is spooled, except for raw binary archives (copied as they are)
+        # and when streaming (encoded again while writing)
+        encode_jobs = []
+        for job_index, (package_info, archive_path, archive_codec) in enumerate(archive_jobs):
+            if stream or (binary and archive_codec is None):
+                spool_path = None
+            else:
+                spool_path = Path(tmpd) / "spool-{}".format(job_index)
+            encode_jobs.append((archive_path, archive_codec, binary, hash_algorithm, spool_path))
+        encode_results = map_jobs(encode_archive, encode_jobs, max_workers=jobs)
+        # archive offsets are relative to the archives section, so that
+        # they do not change when the header is replaced
+        archive_offset = 0
+        for (package_info, archive_path, archive_codec), (archive_hash, archive_length) in \
+                zip(archive_jobs, encode_results):
+            archive_offset += len(make_archive_entry(
+                package_info['name'], archive_hash, archive_length, binary))
+            set_archive_info(package_info, archive_path, archive_hash,
+                             archive_offset, archive_length, archive_codec)
+            archive_offset += archive_length
+        state['fingerprint'] = box_file.make_fingerprint(state)
+
+        # second pass: write the box sequentially
+        with contextlib.ExitStack() as stack:
+            if stream:
+                f_out = sys.stdout.buffer
+            else:
+                f_out = stack.enter_context(open(output_path, "wb"))
+            f_out.write(box_file.create_header(state).encode('utf-8'))
+            f_out.write(runtime_source.encode('utf-8'))
+            f_out.write(section_mark.encode('utf-8'))
+            for (package_info, archive_path, archive_codec), encode_job in \
+                    zip(archive_jobs, encode_jobs):
+                f_out.write(make_archive_entry(
+                    package_info['name'], package_info['hash'], package_info['length'], binary))
+                spool_path = encode_job[-1]
+                if spool_path is None and binary and archive_codec is None:
+                    spool_path = archive_path
+                if spool_path is not None:
+                    with open(spool_path, "rb") as spool_file:
+                        box_file.copy_range(spool_file, f_out, 0, package_info['length'])
+                    continue
+                hashobj = hashlib.new(hash_algorithm)
+                for data in iter_encoded(iter_archive_data(archive_path, archive_codec, hashobj),
+                                         binary):
+                    f_out.write(data)
+                if hashobj.hexdigest() != package_info['hash']:
+                    raise BoxFileError("archive {} changed while writing the box".format(
+                        archive_path))
+            if binary:
+                f_out.write(box_file.make_bootstrap())
+            f_out.flush()
+        if stream:
+            return
         output_path.chmod(mode)
-        box_file.replace_state(output_path, state)
 
         if check:
             check_box(output_path, Path(tmpd) / "bentobox_install_dir")
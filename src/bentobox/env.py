@@ -10,6 +10,8 @@ __all__ = [
     'get_bentobox_version',
     'get_bentobox_home',
     'get_bentobox_boxes_dir',
+    'get_build_cache_dir',
+    'get_build_cache_size',
 ]
 
 
@@ -33,3 +35,11 @@ def get_bentobox_home():
 
 def get_bentobox_boxes_dir():
     return BENTOBOX_HOME.joinpath("boxes")
+
+
+def get_build_cache_dir():
+    return BENTOBOX_HOME.joinpath("build-cache")
+
+
+def get_build_cache_size():
+    return int(os.environ.get("BENTOBOX_BUILD_CACHE_SIZE", 1024 ** 3))
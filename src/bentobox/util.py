@@ -1,9 +1,9 @@
 import functools
-import tempfile
+import types
 
 from pathlib import Path
 
-from importlib.util import spec_from_file_location, module_from_spec
+from .box_file import read_box_source
 
 __all__ = [
     'load_box_module',
@@ -12,17 +12,16 @@ __all__ = [
 
 def load_box_module(box_path):
     box_path = Path(box_path).resolve()
-    return _load_box_module(box_path)
+    box_stat = box_path.stat()
+    # the box stat is part of the cache key: a changed box is reloaded
+    return _load_box_module(box_path, box_stat.st_mtime_ns, box_stat.st_size)
 
 
 @functools.lru_cache(maxsize=10)
-def _load_box_module(box_path):
-    with tempfile.TemporaryDirectory() as tmpd:
-        box_name = box_path.name
-        box_link = Path(tmpd) / (box_name + ".py")
-        box_link.symlink_to(box_path)
-        spec = spec_from_file_location(box_name, str(box_link))
-        module = module_from_spec(spec)
-        module.__file__ = str(box_path)
-        spec.loader.exec_module(module)
-        return module
+def _load_box_module(box_path, mtime_ns, size):  # pylint: disable=unused-argument
+    # only the box source is compiled: the box may contain a binary payload
+    module = types.ModuleType(box_path.name)
+    module.__file__ = str(box_path)
+    code = compile(read_box_source(box_path), str(box_path), 'exec')
+    exec(code, module.__dict__)  # pylint: disable=exec-used
+    return module
@@ -0,0 +1,43 @@
+"""
+Tests of create_box_file
+"""
+
+import zipfile
+
+from bentobox.box_reader import BoxReader
+from bentobox.create_box_file import create_box_file
+
+
+def make_wheel(wheel_path, name, version):
+    """Make a minimal pure-python wheel"""
+    dist_info = "{}-{}.dist-info".format(name, version)
+    with zipfile.ZipFile(wheel_path, "w") as wheel_file:
+        wheel_file.writestr(name + ".py", "")
+        wheel_file.writestr(dist_info + "/METADATA", """\
+Metadata-Version: 2.1
+Name: {}
+Version: {}
+""".format(name, version))
+        wheel_file.writestr(dist_info + "/WHEEL", """\
+Wheel-Version: 1.0
+Generator: bentobox-tests
+Root-Is-Purelib: true
+Tag: py3-none-any
+""")
+        wheel_file.writestr(dist_info + "/RECORD", "")
+
+
+def test_bundle_deps_relative_archive(tmp_path, monkeypatch):
+    wheelhouse = tmp_path / "wheelhouse"
+    wheelhouse.mkdir()
+    wheel_name = "bbdep-1.0-py3-none-any.whl"
+    make_wheel(wheelhouse / wheel_name, "bbdep", "1.0")
+    monkeypatch.chdir(tmp_path)
+    box_path = tmp_path / "bbdep"
+    create_box_file("bbdep", output_path=box_path,
+                    packages=["wheelhouse/" + wheel_name],
+                    bundle_deps=True, find_links=["wheelhouse"],
+                    check=False, verbose_level=0)
+    reader = BoxReader(box_path)
+    assert reader.state['bundle_deps']
+    assert [name for _, name, _ in reader.get_archives()] == [wheel_name]